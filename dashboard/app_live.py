@@ -33,7 +33,9 @@ def clear_database():
             port=DB_PORT
         )
         cur = conn.cursor()
-        cur.execute("DELETE FROM events")
+        # TRUNCATE empties every monthly partition at once and leaves no dead rows to vacuum.
+        # The rollups and cart states are derived from events, so they are reset with them
+        cur.execute("TRUNCATE events, event_context, event_rollup_hourly, customer_cart_state, cart_abandonments")
         conn.commit()
         cur.close()
         conn.close()
@@ -55,7 +57,7 @@ def load_data():
             e.event_id,
             e.customer_id, 
             e.product_id,
-            COALESCE(e.product_title, p.title) as product_title, 
+            p.title as product_title, 
             COALESCE(e.product_price, p.price) as product_price,
             e.action, 
             e.timestamp,
@@ -79,6 +81,27 @@ def load_data():
         st.error(f"Error loading data: {e}")
         return pd.DataFrame()
 
+@st.cache_data(ttl=5)
+def load_rollups(level):
+    """Per-bucket event counts from the rollup tables (hour or day), kept up to date at ingest"""
+    source, bucket = {
+        'hour': ('event_rollup_hourly', 'hour_bucket'),
+        'day': ('event_rollup_daily', 'bucket'),
+    }[level]
+    query = f"""
+        SELECT r.{bucket} as bucket, r.action, p.title as product_title, r.event_count, r.price_sum
+        FROM {source} r
+        LEFT JOIN products p ON r.product_id = p.product_id
+        ORDER BY r.{bucket}
+    """
+    try:
+        rollups = pd.read_sql(query, engine)
+        rollups['bucket'] = pd.to_datetime(rollups['bucket'])
+        return rollups
+    except Exception as e:
+        st.error(f"Error loading rollups: {e}")
+        return pd.DataFrame(columns=['bucket', 'action', 'product_title', 'event_count', 'price_sum'])
+
 with st.spinner("Loading data..."):
     df = load_data()
 
@@ -131,6 +154,17 @@ if not df_filtered.empty:
     if selected_actions:
         df_filtered = df_filtered[df_filtered['action'].isin(selected_actions)]
 
+def filter_rollups(rollups):
+    """Apply the sidebar date range and action filters to rollup rows"""
+    if len(date_range) == 2:
+        rollups = rollups[
+            (rollups['bucket'].dt.date >= date_range[0]) &
+            (rollups['bucket'].dt.date <= date_range[1])
+        ]
+    if selected_actions:
+        rollups = rollups[rollups['action'].isin(selected_actions)]
+    return rollups
+
 # ---------------------- KEY METRICS ----------------------
 st.header("📈 Key Performance Metrics")
 
@@ -329,9 +363,6 @@ if not df_filtered.empty:
         else:
             return "Autumn"
     
-    # Add season to dataframe
-    df_filtered['season'] = df_filtered['timestamp'].apply(get_season)
-    
     # Product selector for seasonal analysis
     seasonal_product = st.selectbox(
         "Select Product for Seasonal Analysis",
@@ -339,15 +370,17 @@ if not df_filtered.empty:
         key="seasonal_product_selector"
     )
     
-    # Filter data for selected product and purchases
-    seasonal_data = df_filtered[
-        (df_filtered['product_title'] == seasonal_product) & 
-        (df_filtered['action'] == 'add_to_cart')
-    ]
+    # Daily rollups for the selected product and purchases
+    daily_rollups = filter_rollups(load_rollups('day'))
+    seasonal_data = daily_rollups[
+        (daily_rollups['product_title'] == seasonal_product) & 
+        (daily_rollups['action'] == 'add_to_cart')
+    ].copy()
     
     if not seasonal_data.empty:
         # Count purchases per season for selected product
-        seasonal_counts = seasonal_data.groupby('season').size().reset_index(name='purchase_count')
+        seasonal_data['season'] = seasonal_data['bucket'].apply(get_season)
+        seasonal_counts = seasonal_data.groupby('season')['event_count'].sum().reset_index(name='purchase_count')
         
         # Define season order
         season_order = ['Winter', 'Spring', 'Summer', 'Autumn']
@@ -377,31 +410,22 @@ if not df_filtered.empty:
         key="timeline_product_selector"
     )
     
-    # Filter data for selected product
-    product_timeline_data = df_filtered[df_filtered['product_title'] == selected_product_timeline]
+    # Hourly rollups for the selected product
+    hourly_rollups = filter_rollups(load_rollups('hour'))
+    product_timeline_data = hourly_rollups[hourly_rollups['product_title'] == selected_product_timeline]
     
     if not product_timeline_data.empty:
         # Calculate cumulative purchases over time
-        # Group by timestamp and calculate net purchases (add_to_cart - remove_from_cart)
-        timeline_data = []
-        cumulative_purchases = 0
-        
-        # Sort by timestamp
-        sorted_data = product_timeline_data.sort_values('timestamp')
-        
-        for _, row in sorted_data.iterrows():
-            if row['action'] == 'add_to_cart':
-                cumulative_purchases += 1
-            elif row['action'] == 'remove_from_cart':
-                cumulative_purchases -= 1
-            
-            timeline_data.append({
-                'timestamp': row['timestamp'],
-                'purchases': cumulative_purchases
-            })
+        # Net purchases per hour (add_to_cart - remove_from_cart), then a running total
+        counts = product_timeline_data.pivot_table(
+            index='bucket', columns='action', values='event_count', aggfunc='sum', fill_value=0
+        )
+        adds = counts.get('add_to_cart', 0)
+        removes = counts.get('remove_from_cart', 0)
+        timeline_data = (adds - removes).cumsum().rename('purchases')
         
-        if timeline_data:
-            timeline_df = pd.DataFrame(timeline_data)
+        if not timeline_data.empty:
+            timeline_df = timeline_data.rename_axis('timestamp').reset_index()
             
             fig_timeline = px.line(
                 timeline_df,
@@ -432,8 +456,7 @@ if not df_filtered.empty:
                 st.metric("Peak Purchase Count", max_purchases)
             
             with col3:
-                total_adds = len(product_timeline_data[product_timeline_data['action'] == 'add_to_cart'])
-                total_removes = len(product_timeline_data[product_timeline_data['action'] == 'remove_from_cart'])
+                total_adds = int(product_timeline_data.loc[product_timeline_data['action'] == 'add_to_cart', 'event_count'].sum())
                 st.metric("Add to Cart Events", total_adds)
         else:
             st.info(f"No timeline data available for '{selected_product_timeline}'")
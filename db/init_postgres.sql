@@ -10,6 +10,12 @@
 DROP TABLE IF EXISTS events CASCADE;
 DROP TABLE IF EXISTS customers CASCADE;
 DROP TABLE IF EXISTS products CASCADE;
+DROP TABLE IF EXISTS backfill_progress;
+DROP TABLE IF EXISTS cart_abandonments;
+DROP TABLE IF EXISTS event_rollup_hourly CASCADE;
+DROP TABLE IF EXISTS customer_cart_state CASCADE;
+DROP TABLE IF EXISTS event_context;
+DROP TYPE IF EXISTS event_action;
 
 -- Create customers table
 CREATE TABLE customers (
@@ -31,22 +37,224 @@ CREATE TABLE products (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Create events table
+-- Ingest resolves event products to product_id by title (streaming/storage.py)
+CREATE UNIQUE INDEX idx_products_title ON products(title);
+
+CREATE TYPE event_action AS ENUM ('add_to_cart', 'remove_from_cart', 'purchase_cart');
+
+-- Create events table, range-partitioned by month on the event timestamp.
+-- Date-filtered queries only scan the matching months, and old months are
+-- removed by dropping their partition (see db/partitions.py).
+-- Products are referenced by id only; title, image and description come from
+-- the products table at query time (see the events_enriched view). The price
+-- is kept as it was when the event happened.
+-- Columns are ordered widest fixed-width first so no alignment padding is
+-- needed, with the variable-width price last. The table and its primary key
+-- are about 40% smaller than with VARCHAR ids and actions;
+-- db/migrate_events_compact.py converts older databases.
 CREATE TABLE events (
-    event_id VARCHAR(255) PRIMARY KEY,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    event_id UUID NOT NULL,
     customer_id INTEGER REFERENCES customers(customer_id),
     product_id INTEGER REFERENCES products(product_id),
-    product_title VARCHAR(255),
+    action event_action NOT NULL,
     product_price DECIMAL(10,2),
-    product_image VARCHAR(500),
-    action VARCHAR(50) NOT NULL CHECK (action IN ('add_to_cart', 'remove_from_cart', 'purchase_cart')),
-    description TEXT,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- The partition key has to be part of the primary key
+    PRIMARY KEY (event_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches events outside every monthly partition instead of rejecting them
+CREATE TABLE events_default PARTITION OF events DEFAULT;
+
+-- Request context for the events that have any, kept out of the fact table
+-- because almost no event does
+CREATE TABLE event_context (
+    event_id UUID NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
     session_id VARCHAR(255),
     user_agent TEXT,
-    ip_address INET
+    ip_address INET,
+    PRIMARY KEY (event_id, timestamp)
+);
+
+-- Create the monthly partitions covering [from_date, to_date). Rows already
+-- sitting in events_default for a new month are moved into its partition.
+CREATE OR REPLACE FUNCTION create_events_partitions(from_date DATE, to_date DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_date)::date;
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start < to_date LOOP
+        month_end := (month_start + INTERVAL '1 month')::date;
+        partition_name := 'events_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            EXECUTE format('WITH moved AS (DELETE FROM events_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved', month_start, month_end, partition_name);
+            EXECUTE format('ALTER TABLE events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, month_end);
+            created := created + 1;
+        END IF;
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partitions from the start of the simulated history to three months ahead
+SELECT create_events_partitions(DATE '2024-01-01', (CURRENT_DATE + INTERVAL '3 months')::date);
+
+-- Checkpoints for streaming/backfill.py, so an interrupted backfill resumes where it stopped
+CREATE TABLE backfill_progress (
+    run_name VARCHAR(100) PRIMARY KEY,
+    last_day DATE NOT NULL,
+    events BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Carts flagged by the WebSocket server after sitting idle (see streaming/abandonment.py)
+CREATE TABLE cart_abandonments (
+    abandonment_id VARCHAR(255) PRIMARY KEY,
+    customer_id INTEGER REFERENCES customers(customer_id),
+    abandoned_at TIMESTAMP NOT NULL,
+    last_activity TIMESTAMP,
+    item_count INTEGER,
+    cart_value DECIMAL(10,2),
+    products TEXT
+);
+
+-- Hourly rollups of events by action and product, maintained as events are
+-- stored (streaming/storage.py). Day, week and month levels are views over it.
+-- customer_sketch is a linear-counting bitmap of the customers seen: sketches
+-- merge with bit OR and sketch_distinct() estimates the distinct count. The
+-- standard error is about 3% at 1,000 distinct customers per aggregated row,
+-- 4% at 3,000 and 7% at 5,000; the bitmap saturates near 7,000, where the
+-- estimate stops growing (7,098 when every bit is set).
+CREATE TABLE event_rollup_hourly (
+    hour_bucket TIMESTAMP NOT NULL,
+    action VARCHAR(50) NOT NULL,
+    product_id INTEGER NOT NULL DEFAULT 0,  -- 0 for events without a product (purchases)
+    event_count BIGINT NOT NULL DEFAULT 0,
+    price_sum DECIMAL(14,2) NOT NULL DEFAULT 0,
+    customer_sketch BIT(1024) NOT NULL,
+    PRIMARY KEY (hour_bucket, action, product_id)
 );
 
+-- Single-bit sketch for one customer. hashint8 mixes all input bits, so
+-- sequential customer ids land on uniformly spread bit positions.
+CREATE OR REPLACE FUNCTION customer_sketch(customer_id BIGINT)
+RETURNS BIT(1024) AS $$
+    SELECT CASE WHEN customer_id IS NULL THEN repeat('0', 1024)::BIT(1024)
+           ELSE set_bit(repeat('0', 1024)::BIT(1024), hashint8(customer_id) & 1023, 1)
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Linear-counting estimate of the distinct customers in a (merged) sketch
+CREATE OR REPLACE FUNCTION sketch_distinct(sketch BIT(1024))
+RETURNS BIGINT AS $$
+    SELECT ROUND(-1024 * ln(GREATEST(length(replace(sketch::TEXT, '1', '')), 1) / 1024.0))::BIGINT;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Recompute the hourly rollups from the events table (after a bulk load that bypassed them)
+CREATE OR REPLACE FUNCTION rebuild_event_rollups()
+RETURNS BIGINT AS $$
+    TRUNCATE event_rollup_hourly;
+    INSERT INTO event_rollup_hourly (hour_bucket, action, product_id, event_count, price_sum, customer_sketch)
+    SELECT DATE_TRUNC('hour', timestamp), action, COALESCE(product_id, 0), COUNT(*),
+           COALESCE(SUM(product_price), 0), BIT_OR(customer_sketch(customer_id))
+    FROM events
+    GROUP BY 1, 2, 3;
+    SELECT COUNT(*) FROM event_rollup_hourly;
+$$ LANGUAGE sql;
+
+-- Current cart and purchase history per customer, maintained as events are
+-- stored (streaming/storage.py) so abandoned-cart queries never scan events.
+CREATE TABLE customer_cart_state (
+    customer_id INTEGER PRIMARY KEY REFERENCES customers(customer_id),
+    -- product id -> [net quantity added since the last purchase, highest unit price];
+    -- only products with a positive quantity are in the cart
+    cart_items JSONB NOT NULL DEFAULT '{}',
+    item_count INTEGER NOT NULL DEFAULT 0,
+    open_cart_value DECIMAL(12,2) NOT NULL DEFAULT 0,
+    cart_events BIGINT NOT NULL DEFAULT 0,          -- add/remove events over the customer's lifetime
+    last_activity TIMESTAMP,
+    lifetime_purchases INTEGER NOT NULL DEFAULT 0,
+    last_purchase_at TIMESTAMP
+);
+
+-- Recompute the cart states from the events table (after a bulk load that
+-- bypassed them), for every customer or only the given ones. Events are
+-- ordered by (timestamp, event_id): each product's cart entry nets the
+-- add/remove events after the last purchase in that order, which is what the
+-- incremental path in streaming/storage.py computes as well.
+DROP FUNCTION IF EXISTS rebuild_cart_states();
+CREATE OR REPLACE FUNCTION rebuild_cart_states(only_customers INTEGER[] DEFAULT NULL)
+RETURNS BIGINT AS $$
+DECLARE
+    rebuilt BIGINT;
+BEGIN
+    IF only_customers IS NULL THEN
+        TRUNCATE customer_cart_state;
+    ELSE
+        DELETE FROM customer_cart_state WHERE customer_id = ANY(only_customers);
+    END IF;
+    WITH scoped AS (
+        SELECT * FROM events
+        WHERE only_customers IS NULL OR customer_id = ANY(only_customers)
+    ),
+    purchases AS (
+        SELECT customer_id, COUNT(*) as purchases, MAX(timestamp) as last_purchase_at
+        FROM scoped
+        WHERE action = 'purchase_cart'
+        GROUP BY customer_id
+    ),
+    last_purchase AS (
+        SELECT DISTINCT ON (customer_id) customer_id, timestamp, event_id
+        FROM scoped
+        WHERE action = 'purchase_cart'
+        ORDER BY customer_id, timestamp DESC, event_id DESC
+    ),
+    activity AS (
+        SELECT customer_id, COUNT(*) as cart_events, MAX(timestamp) as last_activity
+        FROM scoped
+        WHERE action IN ('add_to_cart', 'remove_from_cart')
+        GROUP BY customer_id
+    ),
+    open_items AS (
+        SELECT e.customer_id, e.product_id,
+               SUM(CASE WHEN e.action = 'add_to_cart' THEN 1 ELSE -1 END) as quantity,
+               MAX(e.product_price) as price
+        FROM scoped e
+        LEFT JOIN last_purchase lp ON lp.customer_id = e.customer_id
+        WHERE e.action IN ('add_to_cart', 'remove_from_cart') AND e.product_id IS NOT NULL
+        AND (lp.customer_id IS NULL OR (e.timestamp, e.event_id) > (lp.timestamp, lp.event_id))
+        GROUP BY e.customer_id, e.product_id
+    ),
+    carts AS (
+        SELECT customer_id,
+               jsonb_object_agg(product_id, jsonb_build_array(quantity, price)) as cart_items,
+               COALESCE(SUM(quantity) FILTER (WHERE quantity > 0), 0) as item_count,
+               COALESCE(SUM(quantity * COALESCE(price, 0)) FILTER (WHERE quantity > 0), 0) as open_cart_value
+        FROM open_items
+        GROUP BY customer_id
+    )
+    INSERT INTO customer_cart_state (customer_id, cart_items, item_count, open_cart_value, cart_events,
+                                     last_activity, lifetime_purchases, last_purchase_at)
+    SELECT COALESCE(a.customer_id, p.customer_id), COALESCE(c.cart_items, '{}'), COALESCE(c.item_count, 0),
+           COALESCE(c.open_cart_value, 0), COALESCE(a.cart_events, 0), a.last_activity,
+           COALESCE(p.purchases, 0), p.last_purchase_at
+    FROM activity a
+    FULL JOIN purchases p ON p.customer_id = a.customer_id
+    LEFT JOIN carts c ON c.customer_id = COALESCE(a.customer_id, p.customer_id)
+    WHERE COALESCE(a.customer_id, p.customer_id) IS NOT NULL;
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Insert more sample products to replace unknown products
 INSERT INTO products (title, price, description, image_url, category) VALUES
 ('Wireless Bluetooth Headphones', 89.99, 'High-quality wireless headphones with noise cancellation', 'https://example.com/headphones.jpg', 'Electronics'),
@@ -75,31 +283,76 @@ CREATE INDEX IF NOT EXISTS idx_events_customer_id ON events(customer_id);
 CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp);
 CREATE INDEX IF NOT EXISTS idx_events_action ON events(action);
 CREATE INDEX IF NOT EXISTS idx_events_product_id ON events(product_id);
+CREATE INDEX IF NOT EXISTS idx_cart_abandonments_abandoned_at ON cart_abandonments(abandoned_at);
+CREATE INDEX IF NOT EXISTS idx_cart_abandonments_customer_id ON cart_abandonments(customer_id);
+CREATE INDEX IF NOT EXISTS idx_customer_cart_state_open ON customer_cart_state(last_activity) WHERE item_count > 0;
 
--- Create a view for abandoned carts analysis (customers with cart activity but no purchases)
+-- Create a view for abandoned carts analysis (customers whose cart holds items
+-- that were never checked out), served from the open-cart index
 CREATE OR REPLACE VIEW abandoned_carts AS
 SELECT 
     customer_id,
-    COUNT(*) as cart_events,
-    MAX(timestamp) as last_activity,
-    STRING_AGG(DISTINCT product_title, ', ') as abandoned_products,
-    SUM(product_price) as total_abandoned_value
-FROM events 
-WHERE action IN ('add_to_cart', 'remove_from_cart')
-AND customer_id NOT IN (
-    SELECT DISTINCT customer_id 
-    FROM events 
-    WHERE action = 'purchase_cart'
-)
-GROUP BY customer_id;
-
--- Create a view for conversion funnel
+    cart_events,
+    last_activity,
+    (SELECT STRING_AGG(p.title, ', ' ORDER BY p.title)
+     FROM jsonb_each(cart_items) AS item(product_id, entry)
+     JOIN products p ON p.product_id = item.product_id::INTEGER
+     WHERE (item.entry->>0)::INTEGER > 0) as abandoned_products,
+    open_cart_value as total_abandoned_value,
+    item_count,
+    lifetime_purchases
+FROM customer_cart_state
+WHERE item_count > 0;
+
+-- Events with their product details, as they were stored before events were slimmed down
+CREATE OR REPLACE VIEW events_enriched AS
+SELECT 
+    e.event_id,
+    e.customer_id,
+    e.product_id,
+    p.title as product_title,
+    e.product_price,
+    p.image_url as product_image,
+    e.action,
+    CASE e.action
+        WHEN 'add_to_cart' THEN 'Added ' || p.title || ' to cart.'
+        WHEN 'remove_from_cart' THEN 'Removed ' || p.title || ' from cart.'
+        WHEN 'purchase_cart' THEN 'Purchased the cart.'
+    END as description,
+    e.timestamp,
+    x.session_id,
+    x.user_agent,
+    x.ip_address
+FROM events e
+LEFT JOIN products p ON p.product_id = e.product_id
+LEFT JOIN event_context x ON x.event_id = e.event_id AND x.timestamp = e.timestamp;
+
+-- Day, week and month rollups derived from the hourly table
+CREATE OR REPLACE VIEW event_rollup_daily AS
+SELECT DATE_TRUNC('day', hour_bucket) as bucket, action, product_id,
+       SUM(event_count) as event_count, SUM(price_sum) as price_sum, BIT_OR(customer_sketch) as customer_sketch
+FROM event_rollup_hourly
+GROUP BY 1, 2, 3;
+
+CREATE OR REPLACE VIEW event_rollup_weekly AS
+SELECT DATE_TRUNC('week', hour_bucket) as bucket, action, product_id,
+       SUM(event_count) as event_count, SUM(price_sum) as price_sum, BIT_OR(customer_sketch) as customer_sketch
+FROM event_rollup_hourly
+GROUP BY 1, 2, 3;
+
+CREATE OR REPLACE VIEW event_rollup_monthly AS
+SELECT DATE_TRUNC('month', hour_bucket) as bucket, action, product_id,
+       SUM(event_count) as event_count, SUM(price_sum) as price_sum, BIT_OR(customer_sketch) as customer_sketch
+FROM event_rollup_hourly
+GROUP BY 1, 2, 3;
+
+-- Create a view for conversion funnel (unique customers are sketch estimates)
 CREATE OR REPLACE VIEW conversion_funnel AS
 SELECT 
     action,
-    COUNT(*) as event_count,
-    COUNT(DISTINCT customer_id) as unique_customers
-FROM events 
+    SUM(event_count) as event_count,
+    sketch_distinct(BIT_OR(customer_sketch)) as unique_customers
+FROM event_rollup_hourly 
 GROUP BY action
 ORDER BY 
     CASE action 
@@ -108,23 +361,18 @@ ORDER BY
         ELSE 3
     END;
 
--- Create a view for seasonal trends
+-- Create a view for seasonal trends, read from the hourly rollups
 CREATE OR REPLACE VIEW seasonal_trends AS
 SELECT 
-    DATE_TRUNC('hour', timestamp) as hour_bucket,
-    DATE_TRUNC('day', timestamp) as day_bucket,
-    DATE_TRUNC('week', timestamp) as week_bucket,
-    DATE_TRUNC('month', timestamp) as month_bucket,
+    hour_bucket,
+    DATE_TRUNC('day', hour_bucket) as day_bucket,
+    DATE_TRUNC('week', hour_bucket) as week_bucket,
+    DATE_TRUNC('month', hour_bucket) as month_bucket,
     action,
-    COUNT(*) as event_count,
-    COUNT(DISTINCT customer_id) as unique_customers
-FROM events 
-GROUP BY 
-    DATE_TRUNC('hour', timestamp),
-    DATE_TRUNC('day', timestamp),
-    DATE_TRUNC('week', timestamp),
-    DATE_TRUNC('month', timestamp),
-    action;
+    SUM(event_count) as event_count,
+    sketch_distinct(BIT_OR(customer_sketch)) as unique_customers
+FROM event_rollup_hourly 
+GROUP BY hour_bucket, action;
 
 -- Grant permissions (adjust as needed)
 -- GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA public TO postgres;
@@ -0,0 +1,462 @@
+"""Convert the events table to the compact column layout.
+
+Older databases store event_id and action as VARCHAR and carry session_id,
+user_agent and ip_address (always NULL in practice) on every row. ``migrate``
+copies the events into the layout from init_postgres.sql: a native uuid key,
+the event_action enum, fixed-width columns first and the request context in
+the event_context side table. Events from before product ids were stored get
+their product_id from the product title. Databases from before events were
+partitioned get create_events_partitions() first. Views reading events are
+dropped and recreated on the new table, so the old one can be dropped
+without CASCADE. It runs in one transaction and prints table and index sizes
+before and after.
+
+``benchmark`` builds the same synthetic rows in both layouts in a scratch
+schema and reports their sizes, without touching the events table.
+
+Usage:
+    python db/migrate_events_compact.py report
+    python db/migrate_events_compact.py migrate [--keep-old]
+    python db/migrate_events_compact.py benchmark --rows 10000000
+"""
+import argparse
+import os
+import time
+
+import psycopg2
+
+# Database configuration - use environment variables for Docker
+DB_CONFIG = {
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASS", "Rp123456"),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5432"),
+    "dbname": os.getenv("DB_NAME", "customer_events")
+}
+
+BENCH_SCHEMA = "events_layout_bench"
+
+COMPACT_DDL = """
+    DO $$ BEGIN
+        CREATE TYPE event_action AS ENUM ('add_to_cart', 'remove_from_cart', 'purchase_cart');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$;
+
+    -- Foreign keys are named as init_postgres.sql would name them; the old
+    -- table's partitions still hold constraints with those names
+    CREATE TABLE events (
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        event_id UUID NOT NULL,
+        customer_id INTEGER CONSTRAINT events_customer_id_fkey REFERENCES customers(customer_id),
+        product_id INTEGER CONSTRAINT events_product_id_fkey REFERENCES products(product_id),
+        action event_action NOT NULL,
+        product_price DECIMAL(10,2),
+        PRIMARY KEY (event_id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+
+    CREATE TABLE events_default PARTITION OF events DEFAULT;
+
+    CREATE TABLE IF NOT EXISTS event_context (
+        event_id UUID NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        session_id VARCHAR(255),
+        user_agent TEXT,
+        ip_address INET,
+        PRIMARY KEY (event_id, timestamp)
+    );
+"""
+
+EVENT_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_events_customer_id ON events(customer_id);
+    CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp);
+    CREATE INDEX IF NOT EXISTS idx_events_action ON events(action);
+    CREATE INDEX IF NOT EXISTS idx_events_product_id ON events(product_id);
+"""
+
+ENRICHED_VIEW = """
+    CREATE OR REPLACE VIEW events_enriched AS
+    SELECT
+        e.event_id,
+        e.customer_id,
+        e.product_id,
+        p.title as product_title,
+        e.product_price,
+        p.image_url as product_image,
+        e.action,
+        CASE e.action
+            WHEN 'add_to_cart' THEN 'Added ' || p.title || ' to cart.'
+            WHEN 'remove_from_cart' THEN 'Removed ' || p.title || ' from cart.'
+            WHEN 'purchase_cart' THEN 'Purchased the cart.'
+        END as description,
+        e.timestamp,
+        x.session_id,
+        x.user_agent,
+        x.ip_address
+    FROM events e
+    LEFT JOIN products p ON p.product_id = e.product_id
+    LEFT JOIN event_context x ON x.event_id = e.event_id AND x.timestamp = e.timestamp
+"""
+
+# Same as in init_postgres.sql, for databases created before events were partitioned
+PARTITION_FUNCTION = """
+    CREATE OR REPLACE FUNCTION create_events_partitions(from_date DATE, to_date DATE)
+    RETURNS INTEGER AS $$
+    DECLARE
+        month_start DATE := date_trunc('month', from_date)::date;
+        month_end DATE;
+        partition_name TEXT;
+        created INTEGER := 0;
+    BEGIN
+        WHILE month_start < to_date LOOP
+            month_end := (month_start + INTERVAL '1 month')::date;
+            partition_name := 'events_' || to_char(month_start, 'YYYY_MM');
+            IF to_regclass(partition_name) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I (LIKE events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+                EXECUTE format('WITH moved AS (DELETE FROM events_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                               'INSERT INTO %I SELECT * FROM moved', month_start, month_end, partition_name);
+                EXECUTE format('ALTER TABLE events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month_start, month_end);
+                created := created + 1;
+            END IF;
+            month_start := month_end;
+        END LOOP;
+        RETURN created;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+# Views of older schemas that read events, rewritten for the compact layout.
+# Their stored definitions compare action with varchar literals, which the
+# event_action enum does not accept.
+COMPACT_VIEWS = {
+    "events_enriched": ENRICHED_VIEW,
+    "abandoned_carts": """
+        CREATE VIEW abandoned_carts AS
+        SELECT
+            e.customer_id,
+            COUNT(*) as cart_events,
+            MAX(e.timestamp) as last_activity,
+            STRING_AGG(DISTINCT p.title, ', ') as abandoned_products,
+            SUM(e.product_price) as total_abandoned_value
+        FROM events e
+        LEFT JOIN products p ON p.product_id = e.product_id
+        WHERE e.action IN ('add_to_cart', 'remove_from_cart')
+        AND e.customer_id NOT IN (
+            SELECT DISTINCT customer_id
+            FROM events
+            WHERE action = 'purchase_cart'
+        )
+        GROUP BY e.customer_id
+    """,
+    "conversion_funnel": """
+        CREATE VIEW conversion_funnel AS
+        SELECT
+            action,
+            COUNT(*) as event_count,
+            COUNT(DISTINCT customer_id) as unique_customers
+        FROM events
+        GROUP BY action
+        ORDER BY
+            CASE action
+                WHEN 'add_to_cart' THEN 1
+                WHEN 'purchase_cart' THEN 2
+                ELSE 3
+            END
+    """,
+    "seasonal_trends": """
+        CREATE VIEW seasonal_trends AS
+        SELECT
+            DATE_TRUNC('hour', timestamp) as hour_bucket,
+            DATE_TRUNC('day', timestamp) as day_bucket,
+            DATE_TRUNC('week', timestamp) as week_bucket,
+            DATE_TRUNC('month', timestamp) as month_bucket,
+            action,
+            COUNT(*) as event_count,
+            COUNT(DISTINCT customer_id) as unique_customers
+        FROM events
+        GROUP BY 1, 2, 3, 4, 5
+    """,
+}
+
+# The layout before this migration, used as the baseline by ``benchmark``
+VARCHAR_BENCH_DDL = """
+    CREATE TABLE {schema}.events_varchar (
+        event_id VARCHAR(255) NOT NULL,
+        customer_id INTEGER,
+        product_id INTEGER,
+        product_price DECIMAL(10,2),
+        action VARCHAR(50) NOT NULL CHECK (action IN ('add_to_cart', 'remove_from_cart', 'purchase_cart')),
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        session_id VARCHAR(255),
+        user_agent TEXT,
+        ip_address INET,
+        PRIMARY KEY (event_id, timestamp)
+    )
+"""
+
+COMPACT_BENCH_DDL = """
+    CREATE TYPE {schema}.event_action AS ENUM ('add_to_cart', 'remove_from_cart', 'purchase_cart');
+    CREATE TABLE {schema}.events_compact (
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        event_id UUID NOT NULL,
+        customer_id INTEGER,
+        product_id INTEGER,
+        action {schema}.event_action NOT NULL,
+        product_price DECIMAL(10,2),
+        PRIMARY KEY (event_id, timestamp)
+    )
+"""
+
+
+def relation_sizes(cur, table):
+    """``(rows, table_bytes, {index: bytes})`` for a table, summed over its partitions"""
+    cur.execute("""
+        SELECT c.oid FROM pg_class c WHERE c.oid = %s::regclass
+        UNION ALL
+        SELECT i.inhrelid FROM pg_inherits i WHERE i.inhparent = %s::regclass
+    """, (table, table))
+    oids = [oid for (oid,) in cur.fetchall()]
+    cur.execute("""
+        SELECT COALESCE(SUM(GREATEST(reltuples, 0)) FILTER (WHERE relkind <> 'p'), 0)::BIGINT,
+               COALESCE(SUM(pg_table_size(oid)), 0)
+        FROM pg_class WHERE oid = ANY(%s::oid[])
+    """, (oids,))
+    rows, table_bytes = cur.fetchone()
+    # Partition indexes are attached to the parent's, so sizes roll up under the parent index name
+    cur.execute("""
+        WITH RECURSIVE tree AS (
+            SELECT indexrelid AS root, indexrelid AS oid FROM pg_index WHERE indrelid = %s::regclass
+            UNION ALL
+            SELECT t.root, i.inhrelid FROM tree t JOIN pg_inherits i ON i.inhparent = t.oid
+        )
+        SELECT c.relname, SUM(pg_relation_size(tree.oid))
+        FROM tree JOIN pg_class c ON c.oid = tree.root
+        GROUP BY c.relname ORDER BY c.relname
+    """, (table,))
+    return rows, table_bytes, dict(cur.fetchall())
+
+
+def print_sizes(label, sizes):
+    rows, table_bytes, indexes = sizes
+    index_bytes = sum(indexes.values())
+    total = table_bytes + index_bytes
+    per_row = f"{total / rows:8.1f}" if rows else f"{'-':>8}"
+    print(f"{label:<10} {rows:>14,} {table_bytes / 2**20:12.1f} {index_bytes / 2**20:12.1f} "
+          f"{total / 2**20:12.1f} {per_row}")
+    for name, size in indexes.items():
+        print(f"{'':<10}   {name:<38} {size / 2**20:12.1f} MiB")
+
+
+def print_header():
+    print(f"{'layout':<10} {'rows':>14} {'table MiB':>12} {'index MiB':>12} {'total MiB':>12} {'B/row':>8}")
+
+
+def column_types(cur, table):
+    cur.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+    """, (table,))
+    return dict(cur.fetchall())
+
+
+def dependent_views(cur, table):
+    """``[(name, kind, definition)]`` of the views reading ``table`` or its partitions, directly
+    or through other views, in the order they can be created"""
+    cur.execute("""
+        WITH RECURSIVE deps AS (
+            SELECT r.ev_class AS oid, 1 AS depth
+            FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE d.classid = 'pg_rewrite'::regclass
+            AND d.refobjid IN (SELECT %s::regclass UNION ALL
+                               SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+            UNION ALL
+            SELECT r.ev_class, deps.depth + 1
+            FROM deps
+            JOIN pg_depend d ON d.refobjid = deps.oid AND d.classid = 'pg_rewrite'::regclass
+            JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE r.ev_class <> deps.oid
+        )
+        SELECT c.oid::regclass::text,
+               CASE c.relkind WHEN 'm' THEN 'MATERIALIZED VIEW' ELSE 'VIEW' END,
+               pg_get_viewdef(c.oid)
+        FROM deps JOIN pg_class c ON c.oid = deps.oid
+        WHERE c.relkind IN ('v', 'm')
+        GROUP BY c.oid
+        ORDER BY MAX(deps.depth), 1
+    """, (table, table))
+    return cur.fetchall()
+
+
+def recreate_views(cur, views):
+    """Create ``views`` from ``dependent_views()`` again, using ``COMPACT_VIEWS`` where it has them"""
+    for name, kind, definition in views:
+        try:
+            cur.execute(COMPACT_VIEWS.get(name) or f"CREATE {kind} {name} AS {definition}")
+        except psycopg2.Error as e:
+            raise RuntimeError(f"Cannot recreate view {name} on the compact layout ({e.pgerror or e}); "
+                               "drop it, migrate, and create it again by hand") from e
+        print(f"Recreated view {name}")
+
+
+def migrate(conn, keep_old=False):
+    """Copy events into the compact layout; returns False when it is already compact"""
+    with conn.cursor() as cur:
+        columns = column_types(cur, "events")
+        if columns.get("event_id") == "uuid":
+            return False
+        cur.execute("SELECT to_regclass('events_varchar')")
+        if cur.fetchone()[0] is not None:
+            raise RuntimeError("events_varchar is left over from an earlier --keep-old migration; drop it first")
+
+        cur.execute("ANALYZE events")
+        print_header()
+        print_sizes("before", relation_sizes(cur, "events"))
+
+        # Move the old table and everything named after it out of the way
+        cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'events'::regclass")
+        partitions = [name for (name,) in cur.fetchall()]
+        cur.execute("""
+            SELECT indexrelid::regclass::text FROM pg_index
+            WHERE indrelid = 'events'::regclass
+            OR indrelid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'events'::regclass)
+        """)
+        indexes = [name for (name,) in cur.fetchall()]
+        views = dependent_views(cur, "events")
+        for name, kind, _ in reversed(views):
+            cur.execute(f"DROP {kind} {name}")
+        cur.execute("ALTER TABLE events RENAME TO events_varchar")
+        for name in partitions:
+            cur.execute(f'ALTER TABLE "{name}" RENAME TO "{name}_varchar"')
+        for name in indexes:
+            cur.execute(f'ALTER INDEX "{name}" RENAME TO "{name[:55]}_varchar"')
+        sources = [f"{name}_varchar" for name in partitions] or ["events_varchar"]
+
+        cur.execute(COMPACT_DDL)
+        cur.execute("SELECT to_regprocedure('create_events_partitions(date, date)')")
+        if cur.fetchone()[0] is None:
+            cur.execute(PARTITION_FUNCTION)
+        cur.execute("""
+            SELECT create_events_partitions(COALESCE(MIN(timestamp)::date, CURRENT_DATE),
+                                            (CURRENT_DATE + INTERVAL '3 months')::date)
+            FROM events_varchar
+        """)
+
+        # Events stored before product ids were resolved at ingest only carry the title
+        product_id = "w.product_id"
+        joins = ""
+        if "product_title" in columns:
+            cur.execute("""
+                INSERT INTO products (title, price, image_url)
+                SELECT DISTINCT ON (w.product_title) w.product_title, COALESCE(w.product_price, 0), w.product_image
+                FROM events_varchar w
+                WHERE w.product_title IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM products p WHERE p.title = w.product_title)
+            """)
+            product_id = "COALESCE(w.product_id, p.product_id)"
+            joins = ("LEFT JOIN (SELECT title, MIN(product_id) AS product_id FROM products GROUP BY title) p "
+                     "ON p.title = w.product_title")
+
+        for source in sources:
+            started = time.monotonic()
+            cur.execute(f"""
+                INSERT INTO events (timestamp, event_id, customer_id, product_id, action, product_price)
+                SELECT w.timestamp, w.event_id::uuid, w.customer_id, {product_id}, w.action::event_action,
+                       w.product_price
+                FROM "{source}" w {joins}
+                ORDER BY w.timestamp
+            """)
+            if cur.rowcount:
+                print(f"Copied {cur.rowcount:,} events from {source} in {time.monotonic() - started:.1f}s")
+
+        context = [c for c in ("session_id", "user_agent", "ip_address") if c in columns]
+        if context:
+            cur.execute(f"""
+                INSERT INTO event_context (event_id, timestamp, {', '.join(context)})
+                SELECT event_id::uuid, timestamp, {', '.join(context)}
+                FROM events_varchar
+                WHERE {' OR '.join(f'{c} IS NOT NULL' for c in context)}
+                ON CONFLICT DO NOTHING
+            """)
+            print(f"Moved request context of {cur.rowcount:,} events to event_context")
+
+        cur.execute(EVENT_INDEXES)
+        recreate_views(cur, views)
+        cur.execute(ENRICHED_VIEW)
+        if not keep_old:
+            cur.execute("DROP TABLE events_varchar RESTRICT")
+        cur.execute("ANALYZE events")
+        print_sizes("after", relation_sizes(cur, "events"))
+    return True
+
+
+def benchmark(conn, rows, keep=False):
+    """Build ``rows`` synthetic events in both layouts and print their sizes"""
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+        cur.execute(VARCHAR_BENCH_DDL.format(schema=BENCH_SCHEMA))
+        cur.execute(COMPACT_BENCH_DDL.format(schema=BENCH_SCHEMA))
+
+        # Same mix as the simulator: 45% adds, 25% removes, 30% purchases over a year of events
+        started = time.monotonic()
+        cur.execute(f"""
+            INSERT INTO {BENCH_SCHEMA}.events_varchar (event_id, customer_id, product_id, product_price, action, timestamp)
+            SELECT gen_random_uuid()::text, 1 + (random() * 9999)::int,
+                   CASE WHEN r < 0.70 THEN 1 + (random() * 19)::int END,
+                   CASE WHEN r < 0.70 THEN round((10 + random() * 190)::numeric, 2) END,
+                   CASE WHEN r < 0.45 THEN 'add_to_cart' WHEN r < 0.70 THEN 'remove_from_cart' ELSE 'purchase_cart' END,
+                   TIMESTAMP '2024-01-01' + (i * 31536000.0 / %(rows)s) * INTERVAL '1 second'
+            FROM (SELECT i, random() AS r FROM generate_series(1, %(rows)s) AS i) g
+        """, {"rows": rows})
+        cur.execute(f"""
+            INSERT INTO {BENCH_SCHEMA}.events_compact (timestamp, event_id, customer_id, product_id, action, product_price)
+            SELECT timestamp, event_id::uuid, customer_id, product_id, action::{BENCH_SCHEMA}.event_action, product_price
+            FROM {BENCH_SCHEMA}.events_varchar
+            ORDER BY timestamp
+        """)
+        for table in ("events_varchar", "events_compact"):
+            for column in ("customer_id", "timestamp", "action", "product_id"):
+                cur.execute(f"CREATE INDEX {table}_{column}_idx ON {BENCH_SCHEMA}.{table}({column})")
+            cur.execute(f"VACUUM ANALYZE {BENCH_SCHEMA}.{table}")
+        print(f"Built {rows:,} rows in both layouts in {time.monotonic() - started:.1f}s")
+
+        print_header()
+        print_sizes("varchar", relation_sizes(cur, f"{BENCH_SCHEMA}.events_varchar"))
+        print_sizes("compact", relation_sizes(cur, f"{BENCH_SCHEMA}.events_compact"))
+        if not keep:
+            cur.execute(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the events table to the compact column layout")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("report", help="show the table and index sizes of events")
+    migrate_cmd = sub.add_parser("migrate", help="copy events into the compact layout")
+    migrate_cmd.add_argument("--keep-old", action="store_true",
+                             help="keep the old table as events_varchar instead of dropping it")
+    bench = sub.add_parser("benchmark", help="compare both layouts on synthetic rows")
+    bench.add_argument("--rows", type=int, default=10_000_000)
+    bench.add_argument("--keep", action="store_true", help=f"keep the {BENCH_SCHEMA} schema afterwards")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        if args.command == "report":
+            with conn.cursor() as cur:
+                print_header()
+                print_sizes("events", relation_sizes(cur, "events"))
+        elif args.command == "migrate":
+            if migrate(conn, args.keep_old):
+                conn.commit()
+                print("Events table converted to the compact layout")
+            else:
+                print("Events table already uses the compact layout")
+        elif args.command == "benchmark":
+            benchmark(conn, args.rows, args.keep)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Maintenance for the monthly partitions of the events table.
+
+Creates partitions ahead of time so incoming events never land in
+events_default, and detaches or drops months older than the retention window.
+Dropping a month is a catalog operation, so expiring data costs the same no
+matter how many rows the month holds.
+
+Usage:
+    python db/partitions.py list
+    python db/partitions.py create --ahead 3
+    python db/partitions.py create --from 2023-01-01 --to 2024-01-01
+    python db/partitions.py expire --retain 12 [--drop]
+"""
+import argparse
+import os
+import re
+from datetime import date
+
+import psycopg2
+
+# Database configuration - use environment variables for Docker
+DB_CONFIG = {
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASS", "Rp123456"),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5432"),
+    "dbname": os.getenv("DB_NAME", "customer_events")
+}
+
+PARTITION_NAME = re.compile(r"^events_(\d{4})_(\d{2})$")
+
+
+def add_months(day, months):
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def list_partitions(cur):
+    """``(name, month_start, estimated_rows, total_bytes)`` for each monthly partition, oldest first"""
+    cur.execute("""
+        SELECT c.relname, c.reltuples::BIGINT, pg_total_relation_size(c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'events'::regclass
+        ORDER BY c.relname
+    """)
+    partitions = []
+    for name, rows, size in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        month = date(int(match.group(1)), int(match.group(2)), 1) if match else None
+        partitions.append((name, month, max(rows, 0), size))
+    return partitions
+
+
+def create_partitions(cur, from_date, to_date):
+    cur.execute("SELECT create_events_partitions(%s, %s)", (from_date, to_date))
+    return cur.fetchone()[0]
+
+
+def expire_partitions(cur, retain_months, drop=False, today=None):
+    """Detach (or drop) monthly partitions that end before the retention window"""
+    cutoff = add_months((today or date.today()).replace(day=1), -retain_months)
+    expired = []
+    for name, month, _, _ in list_partitions(cur):
+        if month is None or add_months(month, 1) > cutoff:
+            continue
+        cur.execute(f'ALTER TABLE events DETACH PARTITION "{name}"')
+        if drop:
+            cur.execute(f'DROP TABLE "{name}"')
+        expired.append(name)
+    return expired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the events table")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show partitions with estimated rows and size")
+    create = sub.add_parser("create", help="create missing monthly partitions")
+    create.add_argument("--ahead", type=int, default=3, help="months to create past the current one")
+    create.add_argument("--from", dest="from_date", type=date.fromisoformat)
+    create.add_argument("--to", dest="to_date", type=date.fromisoformat)
+    expire = sub.add_parser("expire", help="detach partitions older than the retention window")
+    expire.add_argument("--retain", type=int, required=True, help="months to keep, counting back from this month")
+    expire.add_argument("--drop", action="store_true", help="drop the detached tables as well")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cur:
+            if args.command == "list":
+                for name, month, rows, size in list_partitions(cur):
+                    print(f"{name:<20} {str(month or '-'):<12} ~{rows:>12} rows {size / 2**20:10.1f} MiB")
+            elif args.command == "create":
+                this_month = date.today().replace(day=1)
+                from_date = args.from_date or this_month
+                to_date = args.to_date or add_months(this_month, args.ahead + 1)
+                created = create_partitions(cur, from_date, to_date)
+                print(f"Created {created} partition(s) for {from_date} to {to_date}")
+            elif args.command == "expire":
+                expired = expire_partitions(cur, args.retain, args.drop)
+                action = "Dropped" if args.drop else "Detached"
+                print(f"{action} {len(expired)} partition(s): {', '.join(expired) or 'none'}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
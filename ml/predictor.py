@@ -10,6 +10,7 @@ import seaborn as sns
 from datetime import datetime, timedelta
 import warnings
 import os
+import sys
 warnings.filterwarnings('ignore')
 
 class CustomerAnalytics:
@@ -49,7 +50,7 @@ class CustomerAnalytics:
             e.event_id,
             e.customer_id,
             e.product_id,
-            e.product_title,
+            p.title as product_title,
             e.product_price,
             e.action,
             e.timestamp,
@@ -67,6 +68,53 @@ class CustomerAnalytics:
         df['timestamp'] = pd.to_datetime(df['timestamp'])
         return df
     
+    def load_parquet_data(self, parquet_dir, start_date=None, end_date=None):
+        """Load events compacted by streaming/compaction.py for a date range.
+
+        Only the ``date=YYYY-MM-DD`` partitions inside the range are read, so a
+        day or a month is loaded without parsing the full event history.
+        """
+        # streaming/ modules import each other by bare name
+        streaming_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'streaming')
+        if streaming_dir not in sys.path:
+            sys.path.append(streaming_dir)
+        from compaction import read_parquet_events  # needs pyarrow
+
+        df = read_parquet_events(
+            parquet_dir, start_date, end_date,
+            columns=['event_id', 'customer_id', 'product_id', 'product_title',
+                     'product_price', 'action', 'timestamp'],
+        )
+        return df.sort_values('timestamp').reset_index(drop=True)
+    
+    def load_rollups(self, level='hour', start_date=None, end_date=None):
+        """Load event counts per time bucket, action and product from the rollup tables.
+
+        ``level`` is hour, day, week or month. The result has one row per
+        bucket instead of one per event, so long ranges load quickly.
+        """
+        source = {
+            'hour': 'event_rollup_hourly',
+            'day': 'event_rollup_daily',
+            'week': 'event_rollup_weekly',
+            'month': 'event_rollup_monthly',
+        }[level]
+        bucket = 'hour_bucket' if level == 'hour' else 'bucket'
+        if not self.conn and not self.connect_db():
+            return None
+        
+        query = f"""
+        SELECT r.{bucket} as bucket, r.action, p.title as product_title,
+               r.event_count, r.price_sum, sketch_distinct(r.customer_sketch) as unique_customers
+        FROM {source} r
+        LEFT JOIN products p ON r.product_id = p.product_id
+        WHERE (%(start)s IS NULL OR r.{bucket} >= %(start)s) AND (%(end)s IS NULL OR r.{bucket} < %(end)s)
+        ORDER BY r.{bucket}
+        """
+        df = pd.read_sql(query, self.conn, params={'start': start_date, 'end': end_date})
+        df['bucket'] = pd.to_datetime(df['bucket'])
+        return df
+    
     def analyze_customer_patterns(self, df):
         """Analyze customer purchasing patterns"""
         print("=== CUSTOMER PURCHASING PATTERNS ===")
@@ -89,10 +137,20 @@ class CustomerAnalytics:
         
         return customer_activity
     
-    def analyze_seasonal_trends(self, df):
-        """Analyze seasonal trends in customer behavior"""
+    def analyze_seasonal_trends(self, df, rollups=None):
+        """Analyze seasonal trends in customer behavior
+        
+        Pass hourly ``rollups`` (from ``load_rollups``) to count from those
+        instead of grouping every raw event. Both sources become rows of
+        timestamp, action and event_count, so the same sums serve either.
+        """
         print("\n=== SEASONAL TRENDS ANALYSIS ===")
         
+        if rollups is not None and not rollups.empty:
+            df = rollups[['bucket', 'action', 'event_count']].rename(columns={'bucket': 'timestamp'})
+        else:
+            df = df[['timestamp', 'action']].assign(event_count=1)
+        
         # Add time-based features
         df['hour'] = df['timestamp'].dt.hour
         df['day_of_week'] = df['timestamp'].dt.dayofweek
@@ -100,23 +158,23 @@ class CustomerAnalytics:
         df['day_of_month'] = df['timestamp'].dt.day
         
         # Hourly patterns
-        hourly_activity = df.groupby('hour')['event_id'].count()
+        hourly_activity = df.groupby('hour')['event_count'].sum()
         peak_hour = hourly_activity.idxmax()
         print(f"Peak activity hour: {peak_hour}:00 ({hourly_activity[peak_hour]} events)")
         
         # Daily patterns
-        daily_activity = df.groupby('day_of_week')['event_id'].count()
+        daily_activity = df.groupby('day_of_week')['event_count'].sum()
         day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
         peak_day = day_names[daily_activity.idxmax()]
         print(f"Peak activity day: {peak_day} ({daily_activity.max()} events)")
         
         # Monthly trends
-        monthly_activity = df.groupby('month')['event_id'].count()
+        monthly_activity = df.groupby('month')['event_count'].sum()
         peak_month = monthly_activity.idxmax()
         print(f"Peak activity month: {peak_month} ({monthly_activity[peak_month]} events)")
         
         # Purchase patterns by time
-        purchase_hourly = df[df['action'] == 'purchase_cart'].groupby('hour')['event_id'].count()
+        purchase_hourly = df[df['action'] == 'purchase_cart'].groupby('hour')['event_count'].sum()
         if not purchase_hourly.empty:
             peak_purchase_hour = purchase_hourly.idxmax()
             print(f"Peak purchase hour: {peak_purchase_hour}:00 ({purchase_hourly[peak_purchase_hour]} purchases)")
@@ -311,7 +369,14 @@ class CustomerAnalytics:
         
         # Run all analyses
         customer_patterns = self.analyze_customer_patterns(df)
-        seasonal_trends = self.analyze_seasonal_trends(df)
+        try:
+            rollups = self.load_rollups('hour')
+        except Exception as e:
+            print(f"Rollups unavailable ({e}), using raw events for seasonal trends")
+            rollups = None
+            if self.conn:
+                self.conn.rollback()
+        seasonal_trends = self.analyze_seasonal_trends(df, rollups)
         abandoned_carts = self.analyze_abandoned_carts(df)
         conversion_funnel = self.analyze_conversion_funnel(df)
         
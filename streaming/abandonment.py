@@ -0,0 +1,149 @@
+"""Streaming abandoned-cart detection.
+
+The server feeds every incoming event to a ``CartTracker``, which keeps the
+open carts in memory and a min-heap of idle deadlines. A cart is flagged as
+abandoned once nothing has happened to it for ``ABANDON_IDLE_SECONDS`` of
+wall-clock time since its last event arrived (event timestamps are not used,
+since the simulator replays history at many simulated days per second).
+Events stamped more than ``ABANDON_IDLE_SECONDS`` in the past are replayed
+history rather than live shopping and are ignored, as is traffic the server
+does not store (``store=0`` backfills).
+
+Each open cart has at most one heap entry. Activity only updates the cart's
+last-seen time; when an entry comes due and the cart has been active since,
+it is pushed back with the new deadline instead of being flagged. A check
+therefore costs O(log n) per due entry, never a sweep over all carts.
+"""
+import heapq
+import itertools
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+ABANDON_IDLE_SECONDS = float(os.getenv("ABANDON_IDLE_SECONDS", "1800"))
+ABANDON_CHECK_INTERVAL = float(os.getenv("ABANDON_CHECK_INTERVAL", "1"))
+
+ABANDONED = "cart_abandoned"
+CART_ACTIONS = ("add_to_cart", "remove_from_cart", "purchase_cart")
+
+
+class _Cart:
+    __slots__ = ("items", "last_seen", "last_event_time", "armed")
+
+    def __init__(self):
+        self.items = {}             # product key -> [quantity, unit price]
+        self.last_seen = 0.0        # monotonic arrival time of the last event
+        self.last_event_time = None
+        self.armed = False          # has a heap entry
+
+
+class CartTracker:
+    """Open carts keyed by customer, with idle deadlines in a heap"""
+
+    def __init__(self, idle_seconds=ABANDON_IDLE_SECONDS, clock=time.monotonic):
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self.carts = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self.abandoned = 0
+
+    def __len__(self):
+        return len(self.carts)
+
+    def observe(self, event):
+        """Apply one cart event"""
+        cid = event.get("customer_id")
+        action = event.get("action")
+        if cid is None or action not in CART_ACTIONS or self._replayed(event):
+            return
+        if action == "purchase_cart":
+            self.carts.pop(cid, None)
+            return
+        if action == "add_to_cart":
+            cart = self.carts.get(cid)
+            if cart is None:
+                cart = self.carts[cid] = _Cart()
+            item = cart.items.setdefault(_product_key(event), [0, event.get("product_price") or 0])
+            item[0] += 1
+        elif action == "remove_from_cart":
+            cart = self.carts.get(cid)
+            if cart is None:
+                return
+            key = _product_key(event)
+            item = cart.items.get(key)
+            if item is not None:
+                item[0] -= 1
+                if item[0] <= 0:
+                    del cart.items[key]
+            if not cart.items:
+                del self.carts[cid]
+                return
+        cart.last_seen = self.clock()
+        cart.last_event_time = event.get("timestamp")
+        if not cart.armed:
+            cart.armed = True
+            heapq.heappush(self._heap, (cart.last_seen + self.idle_seconds, next(self._sequence), cid, cart))
+
+    def _replayed(self, event):
+        """True for events stamped more than idle_seconds ago, such as the simulator's history"""
+        timestamp = _parse_timestamp(event.get("timestamp"))
+        return (timestamp is not None
+                and timestamp < datetime.now(timezone.utc) - timedelta(seconds=self.idle_seconds))
+
+    def observe_many(self, events):
+        for event in events:
+            self.observe(event)
+
+    def expire(self, now=None):
+        """Abandonment events for every cart idle past the threshold, removing those carts"""
+        now = self.clock() if now is None else now
+        heap = self._heap
+        abandoned = []
+        while heap and heap[0][0] <= now:
+            _, _, cid, cart = heapq.heappop(heap)
+            if self.carts.get(cid) is not cart:
+                continue  # purchased or emptied since the entry was pushed
+            due = cart.last_seen + self.idle_seconds
+            if due > now:
+                heapq.heappush(heap, (due, next(self._sequence), cid, cart))
+                continue
+            del self.carts[cid]
+            abandoned.append(abandonment_event(cid, cart, self.idle_seconds))
+        self.abandoned += len(abandoned)
+        return abandoned
+
+
+def _parse_timestamp(value):
+    """Aware datetime from an ISO timestamp, or None
+
+    Naive timestamps are taken as the server's local time, which is what
+    ``datetime.now().isoformat()`` in a producer on the same host sends.
+    """
+    try:
+        timestamp = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return timestamp if timestamp.tzinfo else timestamp.astimezone()
+
+
+def _product_key(event):
+    return event.get("product_id") or event.get("title")
+
+
+def abandonment_event(cid, cart, idle_seconds):
+    """Wire-format event announcing an abandoned cart"""
+    item_count = sum(quantity for quantity, _ in cart.items.values())
+    value = sum(quantity * float(price) for quantity, price in cart.items.values())
+    return {
+        "event_id": str(uuid.uuid4()),
+        "customer_id": cid,
+        "action": ABANDONED,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "last_activity": cart.last_event_time,
+        "description": f"Abandoned a cart of {item_count} item(s) after {idle_seconds:.0f}s idle.",
+        "cart_items": item_count,
+        "cart_value": round(value, 2),
+        "products": [str(key) for key in cart.items],
+    }
@@ -0,0 +1,84 @@
+"""Memory benchmark: dict-based CartManager vs ArrayCartManager.
+
+Builds both stores for the same synthetic customer set, applies the same
+random add/remove/purchase workload and reports the traced heap size
+(tracemalloc also tracks NumPy buffers) plus operation throughput.
+
+Usage:
+    python streaming/bench_cart_memory.py --customers 1000000 --operations 2000000
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from cart_store import ArrayCartManager
+from event_simulator import CartManager
+
+
+def _workload(customers, products, operations, seed):
+    """The same (customer, action, product) sequence for every store"""
+    rng = random.Random(seed)
+    return [(rng.choice(customers), rng.random(), rng.choice(products), rng.random())
+            for _ in range(operations)]
+
+
+def _apply(cart_mgr, ops):
+    for cid, rand, pid, choice in ops:
+        if cart_mgr.cart_empty(cid) or rand < 0.45:
+            cart_mgr.add_to_cart(cid, pid)
+        elif rand < 0.70:
+            cart_products = sorted(cart_mgr.get_cart_products(cid))
+            cart_mgr.remove_from_cart(cid, cart_products[int(choice * len(cart_products))])
+        else:
+            cart_mgr.purchase_cart(cid)
+
+
+def measure(name, build, ops):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    cart_mgr = build()
+    built = time.perf_counter() - started
+    empty_size, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    _apply(cart_mgr, ops)
+    elapsed = time.perf_counter() - started
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<18} build {built:6.2f}s  empty {empty_size / 2**20:8.1f} MiB  "
+          f"after workload {size / 2**20:8.1f} MiB  peak {peak / 2**20:8.1f} MiB  "
+          f"{len(ops) / elapsed:9.0f} ops/s")
+    return cart_mgr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cart store memory use")
+    parser.add_argument("--customers", type=int, default=1000000)
+    parser.add_argument("--operations", type=int, default=1000000)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    products = list(range(1, args.products + 1))
+    sample = random.Random(args.seed).sample(range(1, args.customers + 1), min(args.customers, 100000))
+    print(f"{args.customers} customers, {args.operations} operations over {len(sample)} active customers\n")
+
+    # Customer ids are built inside each measurement so their cost is counted:
+    # a str per customer for the dict store, one int64 array for the array store
+    dict_ops = _workload([str(c) for c in sample], products, args.operations, args.seed)
+    dict_store = measure("CartManager",
+                         lambda: CartManager([str(c) for c in range(1, args.customers + 1)]), dict_ops)
+    array_ops = _workload(sample, products, args.operations, args.seed)
+    array_store = measure("ArrayCartManager",
+                          lambda: ArrayCartManager(np.arange(1, args.customers + 1, dtype=np.int64)), array_ops)
+
+    mismatched = sum(dict_store.carts[str(c)] != array_store.cart_items(c) for c in sample)
+    print(f"\nCarts differing between stores: {mismatched}")
+
+
+if __name__ == "__main__":
+    main()
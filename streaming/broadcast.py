@@ -0,0 +1,355 @@
+"""Fan-out of ingested events to subscribed WebSocket clients.
+
+Every subscriber has its own bounded outbound queue drained by a dedicated
+writer task, so a slow consumer only ever delays itself. What happens when a
+queue is full is decided by the overflow policy:
+
+- ``drop_oldest``: discard the oldest queued frame to make room
+- ``coalesce``: merge everything queued into a single batch frame
+- ``disconnect``: close the connection so the client can reconnect and catch up
+
+Subscribers may narrow what they receive with handshake parameters, e.g.
+``?actions=add_to_cart,purchase_cart&customers=17,42&products=3``. Filters are
+held in inverted indexes (value -> subscribers) so matching an event only
+touches the subscribers that asked for one of its values.
+
+Recent events are also kept in a bounded in-memory ring buffer with
+monotonically increasing offsets. A late-joining subscriber can catch up from
+it with ``?from_offset=X``, ``?last=N`` or ``?since=M`` (seconds); the replay
+is followed by a ``{"type": "replay_complete", ...}`` control message.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+import websockets.exceptions
+
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "1000"))
+BROADCAST_OVERFLOW = os.getenv("BROADCAST_OVERFLOW", "drop_oldest")
+BROADCAST_STATS_INTERVAL = float(os.getenv("BROADCAST_STATS_INTERVAL", "10"))
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "10000"))
+REPLAY_FRAME_SIZE = int(os.getenv("REPLAY_FRAME_SIZE", "500"))
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+
+class Frame:
+    """An outbound message shared by all subscribers, encoded at most once per codec"""
+
+    __slots__ = ("payload", "created", "_encoded")
+
+    def __init__(self, payload, raw=None, raw_codec=None):
+        self.payload = payload
+        self.created = time.monotonic()
+        self._encoded = {raw_codec.name: raw} if raw is not None else {}
+
+    def encode(self, codec):
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.payload)
+        return data
+
+    def events(self):
+        return self.payload if isinstance(self.payload, list) else [self.payload]
+
+
+class Subscription:
+    """Per-subscriber event filter; ``None`` for a dimension means no constraint"""
+
+    DIMENSIONS = ("actions", "customers", "products")
+
+    def __init__(self, actions=None, customers=None, products=None):
+        self.actions = actions
+        self.customers = customers
+        self.products = products
+
+    @classmethod
+    def from_params(cls, params):
+        """Build from handshake parameters holding comma-separated values"""
+        values = {}
+        for dimension in cls.DIMENSIONS:
+            raw = params.get(dimension)
+            if raw:
+                values[dimension] = {item.strip() for item in raw.split(",") if item.strip()}
+        return cls(**values)
+
+    def constraints(self):
+        """(dimension, values) pairs that this subscription restricts"""
+        return [(d, getattr(self, d)) for d in self.DIMENSIONS if getattr(self, d) is not None]
+
+    def matches(self, event):
+        for dimension, keys in event_keys(event):
+            values = getattr(self, dimension)
+            if values is not None and values.isdisjoint(keys):
+                return False
+        return True
+
+    def __repr__(self):
+        parts = [f"{d}={','.join(sorted(v))}" for d, v in self.constraints()]
+        return " ".join(parts) or "all events"
+
+
+def event_keys(event):
+    """Values an event is indexed under, per filter dimension"""
+    products = set()
+    if event.get("product_id") is not None:
+        products.add(str(event["product_id"]))
+    if event.get("title"):
+        products.add(event["title"])
+    return (
+        ("actions", (event.get("action"),)),
+        ("customers", (str(event.get("customer_id")),)),
+        ("products", products),
+    )
+
+
+class ReplayBuffer:
+    """Ring buffer of the most recent events, addressed by offset"""
+
+    def __init__(self, size=REPLAY_BUFFER_SIZE):
+        self.size = size
+        self._entries = deque(maxlen=size)  # (offset, received_at, event)
+        self.next_offset = 0
+
+    def extend(self, events):
+        received_at = time.time()
+        for event in events:
+            self._entries.append((self.next_offset, received_at, event))
+            self.next_offset += 1
+
+    @property
+    def first_offset(self):
+        return self._entries[0][0] if self._entries else self.next_offset
+
+    def read(self, from_offset=None, last=None, since=None):
+        """Events matching any combination of offset, count and age limits"""
+        start = self.first_offset
+        if from_offset is not None:
+            start = max(start, from_offset)
+        if last is not None:
+            start = max(start, self.next_offset - last)
+        # Offsets are contiguous, so the start position is a subtraction away
+        skip = max(0, start - self.first_offset)
+        entries = list(self._entries)[skip:]
+        if since is not None:
+            cutoff = time.time() - since
+            entries = [entry for entry in entries if entry[1] >= cutoff]
+        return [event for _, _, event in entries]
+
+
+class Subscriber:
+    """One connected consumer with its own bounded send queue"""
+
+    def __init__(self, websocket, codec, max_queue=BROADCAST_QUEUE_SIZE, overflow=BROADCAST_OVERFLOW,
+                 subscription=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.websocket = websocket
+        self.codec = codec
+        self.subscription = subscription or Subscription()
+        self.dimensions = len(self.subscription.constraints())
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.name = _describe(websocket)
+        self.queue = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+        self._closing = None
+
+    def offer(self, frame):
+        """Queue a frame without waiting; applies the overflow policy when full"""
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_queue:
+            if self.overflow == "drop_oldest":
+                self.queue.popleft()
+                self.dropped += 1
+            elif self.overflow == "coalesce":
+                events = []
+                for queued in self.queue:
+                    events.extend(queued.events())
+                events.extend(frame.events())
+                merged = Frame(events)
+                merged.created = self.queue[0].created
+                self.queue.clear()
+                frame = merged
+            else:
+                print(f"Disconnecting slow consumer {self.name} ({len(self.queue)} frames behind)")
+                self.closed = True
+                self.queue.clear()
+                # Kept so the close handshake is not garbage collected mid-flight
+                self._closing = asyncio.create_task(self.websocket.close(code=1013, reason="slow consumer"))
+                return
+        self.queue.append(frame)
+        self._ready.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self.queue:
+                    frame = self.queue.popleft()
+                    await self.websocket.send(frame.encode(self.codec))
+                    self.sent += 1
+        except websockets.exceptions.ConnectionClosed:
+            self.closed = True
+
+    def lag(self):
+        """Queued frames and age in seconds of the oldest one"""
+        if not self.queue:
+            return 0, 0.0
+        return len(self.queue), time.monotonic() - self.queue[0].created
+
+    async def close(self):
+        self.closed = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if self._closing is not None:
+            try:
+                await self._closing
+            except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
+                pass
+
+
+class Broadcaster:
+    """Registry of subscribers; publishing never waits on any of them"""
+
+    def __init__(self, max_queue=BROADCAST_QUEUE_SIZE, overflow=BROADCAST_OVERFLOW,
+                 replay_size=REPLAY_BUFFER_SIZE):
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.subscribers = {}
+        self.replay = ReplayBuffer(replay_size)
+        # Subscribers without filters get every frame as-is
+        self._unfiltered = set()
+        # dimension -> value -> subscribers filtering on that value
+        self._index = {dimension: {} for dimension in Subscription.DIMENSIONS}
+
+    def add(self, websocket, codec, subscription=None):
+        subscriber = Subscriber(websocket, codec, self.max_queue, self.overflow, subscription)
+        self.subscribers[websocket] = subscriber
+        if subscriber.dimensions == 0:
+            self._unfiltered.add(subscriber)
+        for dimension, values in subscriber.subscription.constraints():
+            index = self._index[dimension]
+            for value in values:
+                index.setdefault(value, set()).add(subscriber)
+        return subscriber
+
+    def catch_up(self, websocket, from_offset=None, last=None, since=None):
+        """Queue buffered events for a subscriber ahead of any live frames"""
+        subscriber = self.subscribers[websocket]
+        events = self.replay.read(from_offset, last, since)
+        if subscriber.dimensions:
+            events = [event for event in events if subscriber.subscription.matches(event)]
+        for start in range(0, len(events), REPLAY_FRAME_SIZE):
+            subscriber.offer(Frame(events[start:start + REPLAY_FRAME_SIZE]))
+        subscriber.offer(Frame({
+            "type": "replay_complete",
+            "replayed": len(events),
+            "first_offset": self.replay.first_offset,
+            "next_offset": self.replay.next_offset,
+            "truncated": from_offset is not None and from_offset < self.replay.first_offset,
+        }))
+        return len(events)
+
+    async def remove(self, websocket):
+        subscriber = self.subscribers.pop(websocket, None)
+        if subscriber is None:
+            return
+        self._unfiltered.discard(subscriber)
+        for dimension, values in subscriber.subscription.constraints():
+            index = self._index[dimension]
+            for value in values:
+                members = index.get(value)
+                if members is not None:
+                    members.discard(subscriber)
+                    if not members:
+                        del index[value]
+        await subscriber.close()
+
+    def _match(self, event):
+        """Filtered subscribers whose every constraint matches ``event``
+
+        Each indexed hit counts one satisfied dimension, so the cost is the
+        number of hits rather than the number of subscribers.
+        """
+        hits = {}
+        for dimension, keys in event_keys(event):
+            index = self._index[dimension]
+            if not index:
+                continue
+            matched = set()
+            for key in keys:
+                matched.update(index.get(key, ()))
+            for subscriber in matched:
+                hits[subscriber] = hits.get(subscriber, 0) + 1
+        return [subscriber for subscriber, count in hits.items() if count == subscriber.dimensions]
+
+    def publish(self, payload, raw=None, raw_codec=None):
+        """Queue an event (or batch) for every subscriber whose filters match"""
+        frame = Frame(payload, raw, raw_codec)
+        self.replay.extend(frame.events())
+        if not self.subscribers:
+            return
+        for subscriber in self._unfiltered:
+            subscriber.offer(frame)
+        if len(self._unfiltered) == len(self.subscribers):
+            return
+
+        events = frame.events()
+        if len(events) == 1:
+            for subscriber in self._match(events[0]):
+                subscriber.offer(frame)
+            return
+
+        # Batch frame: collect the matching positions per subscriber
+        positions = {}
+        for position, event in enumerate(events):
+            for subscriber in self._match(event):
+                positions.setdefault(subscriber, []).append(position)
+        subsets = {}
+        for subscriber, matched in positions.items():
+            if len(matched) == len(events):
+                subscriber.offer(frame)
+                continue
+            key = tuple(matched)
+            subset = subsets.get(key)
+            if subset is None:
+                subset = subsets[key] = Frame([events[i] for i in matched])
+            subscriber.offer(subset)
+
+    def report(self, limit=10):
+        """Print the subscribers that are furthest behind"""
+        lagging = []
+        for subscriber in self.subscribers.values():
+            depth, age = subscriber.lag()
+            if depth or subscriber.dropped:
+                lagging.append((age, depth, subscriber))
+        if not lagging:
+            return
+        lagging.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        print(f"Broadcast lag ({len(lagging)} of {len(self.subscribers)} subscribers behind):")
+        for age, depth, subscriber in lagging[:limit]:
+            print(f"  {subscriber.name}: {depth} frames queued, oldest {age:.2f}s, "
+                  f"sent {subscriber.sent}, dropped {subscriber.dropped}")
+
+    async def run_reporter(self, interval=BROADCAST_STATS_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.report()
+
+
+def _describe(websocket):
+    address = getattr(websocket, "remote_address", None)
+    if isinstance(address, (list, tuple)) and len(address) >= 2:
+        return f"{address[0]}:{address[1]}"
+    return str(id(websocket))
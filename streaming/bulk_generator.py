@@ -0,0 +1,197 @@
+"""Vectorized bulk event generation for historical backfill.
+
+Produces whole arrays of customers, actions, products, timestamps and event
+ids with NumPy instead of one ``generate_event`` call per event. Cart state
+follows the same rules as ``CartManager``: an empty cart can only be added
+to, a removal picks one of the distinct products in the cart, and a purchase
+empties the cart.
+
+The cart state is inherently sequential per customer, so each batch is
+processed in rounds: round k holds every customer's k-th event of the batch.
+Within a round all customers are distinct, so the cart updates are plain
+fancy-indexed array operations.
+"""
+import numpy as np
+
+from event_simulator import ACTIONS, make_description
+
+ADD, REMOVE, PURCHASE = 0, 1, 2
+
+# Same branch probabilities as generate_event for a non-empty cart
+ADD_THRESHOLD = 0.45
+REMOVE_THRESHOLD = 0.70
+
+SECONDS_PER_DAY = 86400
+
+
+class EventBatch:
+    """Column arrays for a block of generated events, in timestamp order"""
+
+    def __init__(self, customer_ids, actions, product_idx, timestamps, id_bytes, catalog):
+        self.customer_ids = customer_ids    # customer ids as given to the generator
+        self.actions = actions              # int8 codes into ACTIONS
+        self.product_idx = product_idx      # int32 positions in the product list, -1 for purchases
+        self.timestamps = timestamps        # datetime64[s], UTC
+        self.id_bytes = id_bytes            # (n, 16) uint8, random UUIDv4 bytes
+        self.catalog = catalog
+
+    def __len__(self):
+        return len(self.actions)
+
+    def event_ids(self):
+        """UUID strings for every event"""
+        h = self.id_bytes.tobytes().hex()
+        return [f"{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}"
+                for i in range(0, len(h), 32)]
+
+    def iso_timestamps(self):
+        return np.datetime_as_string(self.timestamps, unit="s", timezone="UTC").tolist()
+
+    def rows(self):
+        """Tuples in ``storage.EVENT_COLUMNS`` order, for COPY straight into the events table"""
+        catalog = self.catalog
+        products = catalog.products
+        for event_id, cid, action, p, ts in zip(self.event_ids(), self.customer_ids.tolist(),
+                                                 self.actions.tolist(), self.product_idx.tolist(),
+                                                 self.iso_timestamps()):
+            if p >= 0:
+                product = products[p]
+                yield (event_id, cid, product["id"], product["price"], ACTIONS[action], ts)
+            else:
+                yield (event_id, cid, None, None, ACTIONS[action], ts)
+
+    def to_events(self):
+        """Event dicts in the same shape as ``generate_event`` output"""
+        catalog = self.catalog
+        events = []
+        for event_id, cid, action, p, ts in zip(self.event_ids(), self.customer_ids.tolist(),
+                                                 self.actions.tolist(), self.product_idx.tolist(),
+                                                 self.iso_timestamps()):
+            event = {
+                "event_id": event_id,
+                "customer_id": cid,
+                "action": ACTIONS[action],
+                "timestamp": ts,
+                "description": catalog.descriptions[action][p],
+            }
+            if p >= 0:
+                product = catalog.products[p]
+                event.update({
+                    "product_id": product["id"],
+                    "title": product["title"],
+                    "product_price": product["price"],
+                    "product_image": product["image"],
+                })
+            events.append(event)
+        return events
+
+
+class _Catalog:
+    """Product list with per-action descriptions precomputed by position"""
+
+    def __init__(self, products):
+        self.products = products
+        purchase = make_description("purchase_cart")
+        self.descriptions = {
+            ADD: [make_description("add_to_cart", p["title"]) for p in products],
+            REMOVE: [make_description("remove_from_cart", p["title"]) for p in products],
+            # Purchases carry product index -1, which hits the last slot
+            PURCHASE: [purchase] * len(products),
+        }
+
+
+class BulkEventGenerator:
+    """Generates event batches for a fixed customer and product set"""
+
+    def __init__(self, customers, products, seed=None):
+        self.customers = np.asarray(customers, dtype=object)
+        self.catalog = _Catalog(products)
+        self.rng = np.random.default_rng(seed)
+        # Per-customer cart: quantity of each product, plus number of distinct products
+        self.cart = np.zeros((len(customers), len(products)), dtype=np.uint16)
+        self.distinct = np.zeros(len(customers), dtype=np.int32)
+
+    def generate(self, count, start, seconds):
+        """``count`` events with timestamps spread over ``seconds`` from ``start``"""
+        rng = self.rng
+        n_products = len(self.catalog.products)
+        cust = rng.integers(0, len(self.customers), count)
+        rand = rng.random(count)
+        choice = rng.random(count)
+        add_products = rng.integers(0, n_products, count).astype(np.int32)
+        offsets = np.sort(rng.integers(0, seconds, count))
+        timestamps = np.datetime64(start, "s") + offsets.astype("timedelta64[s]")
+
+        actions = np.empty(count, dtype=np.int8)
+        product_idx = np.full(count, -1, dtype=np.int32)
+        for idx in _rounds(cust):
+            c = cust[idx]
+            empty = self.distinct[c] == 0
+            r = rand[idx]
+            is_add = empty | (r < ADD_THRESHOLD)
+            is_remove = ~empty & (r >= ADD_THRESHOLD) & (r < REMOVE_THRESHOLD)
+            is_purchase = ~empty & (r >= REMOVE_THRESHOLD)
+
+            ai = idx[is_add]
+            if len(ai):
+                ac, ap = cust[ai], add_products[ai]
+                self.distinct[ac] += self.cart[ac, ap] == 0
+                self.cart[ac, ap] += 1
+                actions[ai] = ADD
+                product_idx[ai] = ap
+
+            ri = idx[is_remove]
+            if len(ri):
+                rc = cust[ri]
+                # Uniform choice among the distinct products in each cart
+                nth = (choice[ri] * self.distinct[rc]).astype(np.int64)
+                held = np.cumsum(self.cart[rc] > 0, axis=1)
+                rp = np.argmax(held > nth[:, None], axis=1).astype(np.int32)
+                self.cart[rc, rp] -= 1
+                self.distinct[rc] -= self.cart[rc, rp] == 0
+                actions[ri] = REMOVE
+                product_idx[ri] = rp
+
+            pi = idx[is_purchase]
+            if len(pi):
+                pc = cust[pi]
+                self.cart[pc] = 0
+                self.distinct[pc] = 0
+                actions[pi] = PURCHASE
+
+        id_bytes = np.frombuffer(rng.bytes(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+        id_bytes[:, 6] = (id_bytes[:, 6] & 0x0F) | 0x40
+        id_bytes[:, 8] = (id_bytes[:, 8] & 0x3F) | 0x80
+        return EventBatch(self.customers[cust], actions, product_idx, timestamps, id_bytes, self.catalog)
+
+    def generate_days(self, start_date, end_date, events_per_day):
+        """Yield ``(day, EventBatch)`` for each day in [start_date, end_date)"""
+        day = np.datetime64(start_date.replace(tzinfo=None), "D")
+        last = np.datetime64(end_date.replace(tzinfo=None), "D")
+        while day < last:
+            yield day.astype(object), self.generate(events_per_day, day, SECONDS_PER_DAY)
+            day += np.timedelta64(1, "D")
+
+    def export_carts(self, cart_mgr):
+        """Copy the generated cart contents into a ``CartManager`` or ``ArrayCartManager``"""
+        product_ids = [p["id"] for p in self.catalog.products]
+        for row, cid in enumerate(self.customers):
+            cart_mgr.set_cart(cid, {product_ids[p]: int(self.cart[row, p])
+                                    for p in np.flatnonzero(self.cart[row])})
+
+
+def _rounds(cust):
+    """Split event positions into rounds in which every customer appears at most once"""
+    count = len(cust)
+    if count == 0:
+        return
+    order = np.argsort(cust, kind="stable")
+    sorted_cust = cust[order]
+    starts = np.flatnonzero(np.r_[True, sorted_cust[1:] != sorted_cust[:-1]])
+    lengths = np.diff(np.r_[starts, count])
+    rank = np.empty(count, dtype=np.int64)
+    rank[order] = np.arange(count) - np.repeat(starts, lengths)
+    by_rank = np.argsort(rank, kind="stable")
+    bounds = np.flatnonzero(np.r_[True, np.diff(rank[by_rank]) != 0, True])
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        yield by_rank[lo:hi]
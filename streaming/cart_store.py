@@ -0,0 +1,229 @@
+"""Array-backed cart state for very large customer sets.
+
+``CartManager`` keeps a dict per customer plus a ``datetime`` per customer,
+which costs hundreds of bytes of object overhead each even when the cart is
+empty. ``ArrayCartManager`` has the same methods but keeps:
+
+- customer ids as one sorted int64 array, looked up by offset (contiguous ids)
+  or binary search, so no per-customer key objects exist;
+- the last-change time as int64 epoch seconds (0 for an empty cart);
+- cart items in a shared pool of (product, quantity, next) slots linked from a
+  per-customer head index, so memory grows with the items actually in carts
+  rather than with the number of customers. Items are linked in the order
+  they were first added, as in the dict store, so seeded runs match.
+
+Quantities are uint16; adding past ``MAX_QUANTITY`` raises OverflowError.
+
+Select it for the simulator with ``SIM_CART_STORE=array``; the simulator then
+also loads customer ids into a ``CustomerIds`` array instead of a list of str.
+"""
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+CART_STORE = os.getenv("SIM_CART_STORE", "dict")
+
+EMPTY = -1
+MAX_QUANTITY = int(np.iinfo(np.uint16).max)
+
+
+class CustomerIds:
+    """Read-only sequence of customer ids held in one int64 array.
+
+    Items come out as ``str``, like ``load_customers()`` returns them, so
+    events are identical whichever loader was used; the strings exist only
+    for ids actually picked. Slices stay ``CustomerIds`` and ``np.asarray``
+    returns the int64 array itself.
+    """
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return CustomerIds(self.ids[i])
+        return str(self.ids[i])
+
+    def __iter__(self):
+        return (str(cid) for cid in self.ids.tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or np.dtype(dtype) == self.ids.dtype:
+            return self.ids
+        if np.dtype(dtype) == object:
+            return np.array(list(self), dtype=object)
+        return self.ids.astype(dtype)
+
+
+class ArrayCartManager:
+    """``CartManager`` API over NumPy arrays, for millions of customers"""
+
+    def __init__(self, customers, pool_size=1024):
+        ids = np.sort(np.asarray(customers).astype(np.int64))
+        self.ids = ids
+        self._base = int(ids[0]) if len(ids) else 0
+        # Customer ids are usually a SERIAL range, which makes the index a subtraction
+        self._contiguous = len(ids) > 0 and int(ids[-1]) - self._base + 1 == len(ids)
+        self.head = np.full(len(ids), EMPTY, dtype=np.int32)
+        self.updated = np.zeros(len(ids), dtype=np.int64)
+        self.item_product = np.zeros(pool_size, dtype=np.int32)
+        self.item_quantity = np.zeros(pool_size, dtype=np.uint16)
+        self.item_next = np.arange(1, pool_size + 1, dtype=np.int32)
+        self.item_next[-1] = EMPTY
+        self._free = 0
+        self._views()
+
+    def _views(self):
+        # Scalar reads and writes go through memoryviews, which return plain
+        # ints and are faster than indexing the NumPy arrays element by element
+        self._head = memoryview(self.head)
+        self._updated = memoryview(self.updated)
+        self._product = memoryview(self.item_product)
+        self._quantity = memoryview(self.item_quantity)
+        self._next = memoryview(self.item_next)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, cid):
+        """Array position of a customer id; KeyError if unknown, like ``CartManager``"""
+        if self._contiguous:
+            i = int(cid) - self._base
+            if 0 <= i < len(self.ids):
+                return i
+        else:
+            i = int(np.searchsorted(self.ids, int(cid)))
+            if i < len(self.ids) and self.ids[i] == int(cid):
+                return i
+        raise KeyError(cid)
+
+    def _allocate(self):
+        if self._free == EMPTY:
+            self._grow()
+        node = self._free
+        self._free = self._next[node]
+        return node
+
+    def _grow(self):
+        size = len(self.item_product)
+        self._views_release()
+        self.item_product = np.resize(self.item_product, size * 2)
+        self.item_quantity = np.resize(self.item_quantity, size * 2)
+        self.item_next = np.concatenate([self.item_next, np.arange(size + 1, size * 2 + 1, dtype=np.int32)])
+        self.item_next[-1] = EMPTY
+        self._free = size
+        self._views()
+
+    def _views_release(self):
+        for view in (self._product, self._quantity, self._next):
+            view.release()
+
+    def _items(self, i):
+        nxt = self._next
+        node = self._head[i]
+        while node != EMPTY:
+            yield node
+            node = nxt[node]
+
+    def add_to_cart(self, cid, pid, quantity=1):
+        i = self.index(cid)
+        product = self._product
+        last = EMPTY
+        for node in self._items(i):
+            if product[node] == pid:
+                total = self._quantity[node] + quantity
+                if total > MAX_QUANTITY:
+                    raise OverflowError(f"cart {cid} would hold {total} of product {pid}, over {MAX_QUANTITY}")
+                self._quantity[node] = total
+                break
+            last = node
+        else:
+            if quantity > MAX_QUANTITY:
+                raise OverflowError(f"cart {cid} would hold {quantity} of product {pid}, over {MAX_QUANTITY}")
+            node = self._allocate()
+            self._product[node] = pid
+            self._quantity[node] = quantity
+            # Append, so items come back in insertion order like CartManager's dicts
+            self._next[node] = EMPTY
+            if last == EMPTY:
+                self._head[i] = node
+            else:
+                self._next[last] = node
+        self._updated[i] = int(time.time())
+
+    def remove_from_cart(self, cid, pid):
+        i = self.index(cid)
+        product, nxt = self._product, self._next
+        prev = EMPTY
+        for node in self._items(i):
+            if product[node] == pid:
+                if self._quantity[node] > 1:
+                    self._quantity[node] -= 1
+                else:
+                    if prev == EMPTY:
+                        self._head[i] = nxt[node]
+                    else:
+                        nxt[prev] = nxt[node]
+                    nxt[node] = self._free
+                    self._free = node
+                break
+            prev = node
+        self._updated[i] = int(time.time())
+
+    def _clear(self, i):
+        node = self._head[i]
+        if node == EMPTY:
+            return False
+        nxt = self._next
+        tail = node
+        while nxt[tail] != EMPTY:
+            tail = nxt[tail]
+        nxt[tail] = self._free
+        self._free = node
+        self._head[i] = EMPTY
+        return True
+
+    def purchase_cart(self, cid):
+        i = self.index(cid)
+        if self._clear(i):
+            self._updated[i] = 0
+            return True
+        return False
+
+    def cart_empty(self, cid):
+        return self._head[self.index(cid)] == EMPTY
+
+    def get_cart_products(self, cid):
+        product = self._product
+        return [product[node] for node in self._items(self.index(cid))]
+
+    def cart_items(self, cid):
+        """Product id to quantity, like ``CartManager.carts[cid]``"""
+        product, quantity = self._product, self._quantity
+        return {product[node]: quantity[node] for node in self._items(self.index(cid))}
+
+    def set_cart(self, cid, items):
+        i = self.index(cid)
+        self._clear(i)
+        for pid, quantity in items.items():
+            self.add_to_cart(cid, pid, quantity)
+        if not items:
+            self._updated[i] = 0
+
+    def last_updated(self, cid):
+        """Time of the last cart change, or None for an empty cart"""
+        seconds = self._updated[self.index(cid)]
+        return datetime.fromtimestamp(seconds) if seconds else None
+
+
+def make_cart_manager(customers, kind=CART_STORE):
+    """Cart state for the simulator: ``dict`` (CartManager) or ``array`` (ArrayCartManager)"""
+    if kind == "array":
+        return ArrayCartManager(customers)
+    from event_simulator import CartManager
+    return CartManager(customers)
@@ -0,0 +1,110 @@
+"""Product catalog loading with a local snapshot.
+
+Sources are tried in order: a fresh local snapshot file, the ``products``
+table, then the remote API. Whatever source answers is written back to the
+snapshot, so later startups are instant and work without network access. A
+snapshot older than ``CATALOG_MAX_AGE_HOURS`` is refreshed from the database
+or API, and is still used if neither is reachable.
+"""
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+import requests
+
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             "products_snapshot.json"))
+CATALOG_MAX_AGE_HOURS = float(os.getenv("CATALOG_MAX_AGE_HOURS", "24"))
+CATALOG_API_URL = os.getenv("CATALOG_API_URL", "https://fakestoreapi.com/products")
+CATALOG_API_TIMEOUT = float(os.getenv("CATALOG_API_TIMEOUT", "10"))
+
+
+def read_snapshot(path=CATALOG_SNAPSHOT):
+    """``(products, age_seconds)`` from the snapshot file, or ``(None, None)``"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None, None
+    products = snapshot.get("products")
+    if not products:
+        return None, None
+    return products, time.time() - os.path.getmtime(path)
+
+
+def write_snapshot(products, source, path=CATALOG_SNAPSHOT):
+    snapshot = {
+        "source": source,
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+        "products": products,
+    }
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=1)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Could not write catalog snapshot {path}: {e}")
+
+
+def products_from_db(db_config):
+    conn = psycopg2.connect(connect_timeout=5, **db_config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT product_id, title, price, description, image_url FROM products ORDER BY product_id")
+            return [
+                {
+                    "id": product_id,
+                    "title": title,
+                    "price": float(price) if price is not None else None,
+                    "description": description,
+                    "image": image,
+                }
+                for product_id, title, price, description, image in cur.fetchall()
+            ]
+    finally:
+        conn.close()
+
+
+def products_from_api(url=CATALOG_API_URL, timeout=CATALOG_API_TIMEOUT):
+    resp = requests.get(url, timeout=timeout)
+    resp.raise_for_status()
+    return [
+        {
+            "id": p["id"],
+            "title": p["title"],
+            "price": p["price"],
+            "description": p["description"],
+            "image": p["image"],
+        }
+        for p in resp.json()
+    ]
+
+
+def load_catalog(db_config=None, refresh=False, path=CATALOG_SNAPSHOT, max_age_hours=CATALOG_MAX_AGE_HOURS):
+    """Product dicts (id, title, price, description, image) from the fastest usable source"""
+    snapshot, age = read_snapshot(path)
+    if snapshot and not refresh and age <= max_age_hours * 3600:
+        print(f"Loaded {len(snapshot)} products from snapshot {path}")
+        return snapshot
+
+    sources = []
+    if db_config is not None:
+        sources.append(("database", lambda: products_from_db(db_config)))
+    sources.append(("api", products_from_api))
+    for source, fetch in sources:
+        try:
+            products = fetch()
+        except Exception as e:
+            print(f"Product catalog source '{source}' unavailable: {e}")
+            continue
+        if products:
+            print(f"Loaded {len(products)} products from {source}")
+            write_snapshot(products, source, path)
+            return products
+
+    if snapshot:
+        print(f"Using stale catalog snapshot {path} ({age / 3600:.1f}h old)")
+        return snapshot
+    raise RuntimeError("No product catalog available: no snapshot, database or API")
@@ -0,0 +1,115 @@
+"""Compaction of closed receiver segments into columnar Parquet files.
+
+Each closed JSON Lines segment written by the receiver is converted into
+Parquet files partitioned by event date (``date=YYYY-MM-DD``). Column types
+are fixed, and the low-cardinality columns (action, product title) are
+dictionary-encoded, so a day or month of events can be loaded by reading only
+the matching partitions and columns.
+
+Usage:
+    python streaming/compaction.py [events_dir] [parquet_dir]
+    python streaming/compaction.py events.json [parquet_dir]   # a legacy receiver file
+"""
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from event_log import COMPACTED_DIR, closed_segments, read_events
+
+PARQUET_SCHEMA = pa.schema([
+    ("event_id", pa.string()),
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("customer_id", pa.int32()),
+    ("product_id", pa.int32()),
+    ("action", pa.dictionary(pa.int8(), pa.string())),
+    ("product_title", pa.dictionary(pa.int32(), pa.string())),
+    ("product_price", pa.float64()),
+])
+
+
+def segment_to_frame(path):
+    """Load one JSON Lines segment (or legacy events.json) into a typed DataFrame"""
+    events = [event for event in read_events(path) if "type" not in event]
+    df = pd.DataFrame.from_records(events)
+    for column in ("event_id", "customer_id", "product_id", "action", "title", "product_price", "timestamp"):
+        if column not in df:
+            df[column] = None
+    return pd.DataFrame({
+        "event_id": df["event_id"].astype("string"),
+        "timestamp": pd.to_datetime(df["timestamp"], utc=True, errors="coerce", format="ISO8601"),
+        "customer_id": pd.to_numeric(df["customer_id"], errors="coerce").astype("Int32"),
+        "product_id": pd.to_numeric(df["product_id"], errors="coerce").astype("Int32"),
+        "action": df["action"].astype("category"),
+        "product_title": df["title"].astype("category"),
+        "product_price": pd.to_numeric(df["product_price"], errors="coerce").astype("float64"),
+    })
+
+
+def _to_table(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.cast(PARQUET_SCHEMA)
+
+
+def compact_segment(path, output_dir):
+    """Write one segment as Parquet, one file per event date; returns rows written"""
+    df = segment_to_frame(path)
+    if df.empty:
+        return 0
+    name = os.path.basename(path).split(".")[0]
+    dates = df["timestamp"].dt.strftime("%Y-%m-%d").fillna("unknown")
+    for date, day in df.groupby(dates, sort=True):
+        partition = os.path.join(output_dir, f"date={date}")
+        os.makedirs(partition, exist_ok=True)
+        # Named after the source segment, so re-running a compaction overwrites
+        # its own output instead of duplicating rows
+        target = os.path.join(partition, f"{name}.parquet")
+        pq.write_table(_to_table(day.reset_index(drop=True)), target + ".tmp", compression="zstd")
+        os.replace(target + ".tmp", target)
+    return len(df)
+
+
+def compact_segments(events_dir, output_dir):
+    """Compact every closed segment, then move it aside so it is not compacted twice"""
+    done_dir = os.path.join(events_dir, COMPACTED_DIR)
+    os.makedirs(done_dir, exist_ok=True)
+    total = 0
+    for segment in closed_segments(events_dir):
+        done = os.path.join(done_dir, os.path.basename(segment))
+        if os.path.exists(done):
+            # A segment with this name was compacted before; its Parquet files
+            # would be overwritten with different events
+            raise FileExistsError(f"{done} already exists, refusing to overwrite its compacted output")
+        rows = compact_segment(segment, output_dir)
+        os.replace(segment, done)
+        print(f"Compacted {os.path.basename(segment)}: {rows} events")
+        total += rows
+    return total
+
+
+def read_parquet_events(parquet_dir, start_date=None, end_date=None, columns=None):
+    """Load compacted events, reading only the date partitions in [start_date, end_date]"""
+    filters = []
+    if start_date is not None:
+        filters.append(("date", ">=", str(start_date)))
+    if end_date is not None:
+        filters.append(("date", "<=", str(end_date)))
+    return pd.read_parquet(
+        parquet_dir,
+        columns=columns,
+        filters=filters or None,
+        partitioning=ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive"),
+    )
+
+
+if __name__ == "__main__":
+    events_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv("RECEIVER_EVENTS_DIR", "events")
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else os.getenv("RECEIVER_PARQUET_DIR", "events_parquet")
+    if os.path.isfile(events_dir):
+        total = compact_segment(events_dir, output_dir)
+    else:
+        total = compact_segments(events_dir, output_dir)
+    print(f"Compacted {total} events into {output_dir}")
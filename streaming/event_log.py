@@ -0,0 +1,173 @@
+"""Append-only JSON Lines event log with segment rotation.
+
+Events are appended one per line to the active segment
+``<prefix>-<seq>.jsonl.open``. Data is fsync'd once enough bytes or time have
+accumulated rather than per event, and the segment is closed (renamed to
+``.jsonl``) when it reaches its size limit. Closed segments are never written
+again, so later stages such as compaction can pick them up safely. Compaction
+moves finished segments into ``compacted/``; their sequence numbers stay taken,
+so a restarted writer never reuses a name that already has output.
+"""
+import glob
+import json
+import os
+import time
+
+ACTIVE_SUFFIX = ".jsonl.open"
+CLOSED_SUFFIX = ".jsonl"
+COMPACTED_DIR = "compacted"
+
+SEGMENT_MAX_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+FSYNC_INTERVAL = float(os.getenv("EVENT_LOG_FSYNC_INTERVAL", "1.0"))
+FSYNC_BYTES = int(os.getenv("EVENT_LOG_FSYNC_BYTES", str(1024 * 1024)))
+
+
+class SegmentWriter:
+    """Buffered, append-only writer for a directory of JSON Lines segments"""
+
+    def __init__(self, directory, prefix="events", max_segment_bytes=SEGMENT_MAX_BYTES,
+                 fsync_interval=FSYNC_INTERVAL, fsync_bytes=FSYNC_BYTES):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync_bytes = fsync_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._path = None
+        self._sequence = 0
+        self._size = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._resume()
+
+    def _segment_path(self, sequence, suffix):
+        return os.path.join(self.directory, f"{self.prefix}-{sequence:06d}{suffix}")
+
+    def _resume(self):
+        """Continue the active segment left by a previous run, or start a new one"""
+        sequences = [_sequence_of(path) for path in _segment_files(self.directory, self.prefix)]
+        sequences += [_sequence_of(path) for path in
+                      _segment_files(os.path.join(self.directory, COMPACTED_DIR), self.prefix)]
+        active = sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}-*{ACTIVE_SUFFIX}")))
+        if active:
+            self._open(_sequence_of(active[-1]))
+        else:
+            self._open(max(sequences, default=0) + 1)
+
+    def _open(self, sequence):
+        self._sequence = sequence
+        self._path = self._segment_path(sequence, ACTIVE_SUFFIX)
+        self._file = open(self._path, "ab")
+        self._size = self._file.tell()
+        if self._size and not _ends_with_newline(self._path):
+            # Terminate a line torn by a crash so the next event starts cleanly
+            self._file.write(b"\n")
+            self._size += 1
+
+    def write(self, event):
+        line = (json.dumps(event, separators=(",", ":")) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._size += len(line)
+        self._unsynced += len(line)
+        if self._size >= self.max_segment_bytes:
+            self.rotate()
+        else:
+            self.maybe_sync()
+
+    def write_many(self, events):
+        for event in events:
+            self.write(event)
+
+    def maybe_sync(self):
+        """fsync if the byte or time threshold has been reached"""
+        if self._unsynced and (self._unsynced >= self.fsync_bytes
+                               or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _close_segment(self):
+        self.sync()
+        self._file.close()
+        closed = self._segment_path(self._sequence, CLOSED_SUFFIX)
+        os.replace(self._path, closed)
+        return closed
+
+    def rotate(self):
+        """Close the active segment and start the next one"""
+        closed = self._close_segment()
+        self._open(self._sequence + 1)
+        return closed
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            if self._size:
+                self._close_segment()
+            else:
+                self._file.close()
+                os.remove(self._path)
+
+
+def _segment_files(directory, prefix):
+    return sorted(
+        glob.glob(os.path.join(directory, f"{prefix}-*{CLOSED_SUFFIX}"))
+        + glob.glob(os.path.join(directory, f"{prefix}-*{ACTIVE_SUFFIX}")),
+        key=_sequence_of,
+    )
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def _sequence_of(path):
+    name = os.path.basename(path)
+    return int(name.split("-")[-1].split(".")[0])
+
+
+def closed_segments(directory, prefix="events"):
+    """Segments that are complete and will not be appended to again"""
+    return sorted(glob.glob(os.path.join(directory, f"{prefix}-*{CLOSED_SUFFIX}")), key=_sequence_of)
+
+
+def read_jsonl(path):
+    """Yield events from one JSON Lines file, skipping a torn final line"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def read_events(path, prefix="events"):
+    """Yield events from a segment directory, a single .jsonl file or a legacy events.json
+
+    Receivers before the segment log kept everything in one indent-formatted
+    JSON array; a ``.json`` file that does not parse as one is read as JSON Lines.
+    """
+    if os.path.isdir(path):
+        for segment in _segment_files(path, prefix):
+            yield from read_jsonl(segment)
+    elif path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                events = json.load(f)
+            except json.JSONDecodeError:
+                events = None
+        if isinstance(events, list):
+            yield from events
+        else:
+            yield from read_jsonl(path)
+    else:
+        yield from read_jsonl(path)
@@ -1,13 +1,20 @@
+import argparse
 import asyncio
-import json
 import random
+import time
 import uuid
 from datetime import datetime, timedelta, timezone
 import psycopg2
-import requests
 import websockets
 import os
 
+import numpy as np
+
+import recording
+import wire
+from cart_store import CART_STORE, CustomerIds, make_cart_manager
+from catalog import load_catalog
+
 # DB connection config - use environment variables for Docker
 DB_CONFIG = {
     "user": os.getenv("DB_USER", "postgres"),
@@ -19,21 +26,17 @@ DB_CONFIG = {
 
 WS_URL = os.getenv("WS_URL", "ws://localhost:8765")
 
+# Number of historical events sent per WebSocket frame during backfill
+BATCH_SIZE = int(os.getenv("SIM_BATCH_SIZE", "500"))
+
+def connect_producer(url=WS_URL):
+    """Open a producer connection to the WebSocket server"""
+    return recording.wrap(websockets.connect(wire.with_params(url, role=wire.PRODUCER), ping_interval=10,
+                                             ping_timeout=5, subprotocols=wire.client_subprotocols()))
+
 def fetch_products():
-    url = "https://fakestoreapi.com/products"
-    resp = requests.get(url)
-    resp.raise_for_status()
-    products = resp.json()
-    return [
-        {
-            "id": p["id"],
-            "title": p["title"],
-            "price": p["price"],
-            "description": p["description"],
-            "image": p["image"],
-        }
-        for p in products
-    ]
+    # Local snapshot, then the products table, then fakestoreapi.com
+    return load_catalog(DB_CONFIG)
 
 def load_customers():
     conn = psycopg2.connect(**DB_CONFIG)
@@ -44,6 +47,21 @@ def load_customers():
     conn.close()
     return custs
 
+def load_customer_ids():
+    """Customer ids in one int64 array, without a Python str per customer"""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor(name="customer_ids")
+    cur.itersize = 100000
+    cur.execute("SELECT customer_id FROM customers ORDER BY customer_id;")
+    ids = np.fromiter((row[0] for row in cur), dtype=np.int64)
+    cur.close()
+    conn.close()
+    return CustomerIds(ids)
+
+def load_customers_for(store=CART_STORE):
+    """Customer ids for the simulator's cart store: compact ids for ``array``, a str list otherwise"""
+    return load_customer_ids() if store == "array" else load_customers()
+
 class CartManager:
     def __init__(self, customers):
         self.carts = {cid: {} for cid in customers}
@@ -71,6 +89,8 @@ class CartManager:
         return len(self.carts[cid]) == 0
     def get_cart_products(self, cid):
         return list(self.carts[cid].keys())
+    def set_cart(self, cid, items):
+        self.carts[cid] = dict(items)
 
 ACTIONS = ["add_to_cart", "remove_from_cart", "purchase_cart"]
 
@@ -84,31 +104,42 @@ def make_description(action, product_title=None):
     else:
         return ""
 
-def generate_event(cid, cart_mgr, products):
+def index_products(products):
+    """Dict from product id to product; build it once per catalog and pass it to ``generate_event``"""
+    return {p["id"]: p for p in products}
+
+def generate_event(cid, cart_mgr, products, rng=random, products_by_id=None):
+    """One cart event for ``cid``; pass a seeded ``random.Random`` as ``rng`` for reproducible output
+
+    ``products_by_id`` is ``index_products(products)``; without it removals scan the product list.
+    """
     cart_empty = cart_mgr.cart_empty(cid)
-    rand = random.random()
+    rand = rng.random()
     if cart_empty:
         action = "add_to_cart"
-        product = random.choice(products)
+        product = rng.choice(products)
         cart_mgr.add_to_cart(cid, product["id"])
         desc = make_description(action, product["title"])
     else:
         if rand < 0.45:
             action = "add_to_cart"
-            product = random.choice(products)
+            product = rng.choice(products)
             cart_mgr.add_to_cart(cid, product["id"])
             desc = make_description(action, product["title"])
         elif rand < 0.70:
             cart_products = cart_mgr.get_cart_products(cid)
             if cart_products:
                 action = "remove_from_cart"
-                pid = random.choice(cart_products)
+                pid = rng.choice(cart_products)
                 cart_mgr.remove_from_cart(cid, pid)
-                product = next(p for p in products if p["id"] == pid)
+                if products_by_id is not None:
+                    product = products_by_id[pid]
+                else:
+                    product = next(p for p in products if p["id"] == pid)
                 desc = make_description(action, product["title"])
             else:
                 action = "add_to_cart"
-                product = random.choice(products)
+                product = rng.choice(products)
                 cart_mgr.add_to_cart(cid, product["id"])
                 desc = make_description(action, product["title"])
         else:
@@ -119,11 +150,11 @@ def generate_event(cid, cart_mgr, products):
                 desc = make_description(action)
             else:
                 action = "add_to_cart"
-                product = random.choice(products)
+                product = rng.choice(products)
                 cart_mgr.add_to_cart(cid, product["id"])
                 desc = make_description(action, product["title"])
     event_data = {
-        "event_id": str(uuid.uuid4()),
+        "event_id": str(uuid.uuid4()) if rng is random else str(uuid.UUID(int=rng.getrandbits(128), version=4)),
         "customer_id": cid,
         "action": action,
         "timestamp": None,
@@ -131,53 +162,116 @@ def generate_event(cid, cart_mgr, products):
     }
     if product:
         event_data.update({
+            "product_id": product["id"],
             "title": product["title"],
             "product_price": product["price"],
             "product_image": product["image"],
         })
     return event_data
 
-async def send_events(ws, customers, products, cart_mgr, start_date, end_date):
-    current_date = start_date
-    while current_date < end_date:
-        for _ in range(25):
-            cid = random.choice(customers)
-            event = generate_event(cid, cart_mgr, products)
-            event_time = current_date + timedelta(seconds=random.randint(0, 86399))
-            event["timestamp"] = event_time.isoformat()
-            await ws.send(json.dumps(event))
-        current_date += timedelta(days=1)
+async def send_events(ws, customers, products, cart_mgr, start_date, end_date, rng=random, seed=None):
+    encode = wire.codec_for(ws.subprotocol).encode
+    from bulk_generator import BulkEventGenerator
+
+    # Historical events are generated a day at a time with NumPy and go out
+    # as batch frames (a JSON array per message)
+    generator = BulkEventGenerator(customers, products, seed=seed)
+    batch = []
+    for day, day_events in generator.generate_days(start_date, end_date, 25):
+        batch.extend(day_events.to_events())
+        while len(batch) >= BATCH_SIZE:
+            await ws.send(encode(batch[:BATCH_SIZE]))
+            batch = batch[BATCH_SIZE:]
+    if batch:
+        await ws.send(encode(batch))
+    # Live events continue from the carts the history left behind
+    generator.export_carts(cart_mgr)
+    current_date = end_date
+    products_by_id = index_products(products)
     print(f"Sent historical data from {start_date.date()} to {end_date.date()}")
     while True:
         day_events = []
         for _ in range(25):
-            cid = random.choice(customers)
-            event = generate_event(cid, cart_mgr, products)
-            event_time = current_date + timedelta(seconds=random.randint(0, 86399))
+            cid = rng.choice(customers)
+            event = generate_event(cid, cart_mgr, products, rng, products_by_id)
+            event_time = current_date + timedelta(seconds=rng.randint(0, 86399))
             event["timestamp"] = event_time.isoformat()
-            await ws.send(json.dumps(event))
+            await ws.send(encode(event))
             day_events.append(event)
         print(f"Sent {len(day_events)} events for {current_date.date()}")
         current_date += timedelta(days=1)
         await asyncio.sleep(1)
 
-async def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="E-commerce event simulator")
+    parser.add_argument("--mode", choices=["live", "load", "shoppers"], default="live",
+                        help="live: 2024 backfill then one simulated day per second; "
+                             "load: fixed-rate load test; shoppers: one connection per simulated shopper")
+    parser.add_argument("--rate", type=float, default=1000, help="target events/sec (load mode)")
+    parser.add_argument("--connections", type=int, default=1, help="concurrent producer connections (load mode)")
+    parser.add_argument("--duration", type=float, default=60, help="run duration in seconds (load mode)")
+    parser.add_argument("--batch-size", type=int, default=1, help="events per frame (load mode)")
+    parser.add_argument("--shoppers", type=int, default=1000, help="concurrent shopper connections (shoppers mode)")
+    parser.add_argument("--think-time", type=float, default=5, help="mean seconds between a shopper's actions")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds over which shoppers connect")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes, each owning a disjoint customer shard (load and shoppers "
+                             "modes; rate, connections and shoppers are totals split across workers)")
+    parser.add_argument("--seed", type=int, help="seed the generated events so runs are reproducible")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record every sent frame to a gzip JSON Lines file for recording.py to replay")
+    args = parser.parse_args()
+    if args.record and args.workers > 1:
+        parser.error("--record needs a single process; drop --workers")
+    if args.workers > 1 and args.mode == "live":
+        parser.error("--workers applies to load and shoppers modes only")
+    return args
+
+async def main(args):
     print(f"Starting event simulator...")
     print(f"Database config: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}")
     print(f"WebSocket URL: {WS_URL}")
     products = fetch_products()
-    customers = load_customers()
-    cart_mgr = CartManager(customers)
+    customers = load_customers_for()
+    if args.record:
+        recording.start(args.record)
+    try:
+        await _run(args, customers, products)
+    finally:
+        recording.stop()
+
+async def _run(args, customers, products):
+    if args.mode == "load":
+        from load_generator import run_load_test
+        started = time.monotonic()
+        stats = await run_load_test(customers, products, args.rate, args.connections,
+                                    args.duration, args.batch_size, seed=args.seed)
+        stats.report(time.monotonic() - started, args.rate)
+        return
+    if args.mode == "shoppers":
+        from load_generator import run_shoppers
+        started = time.monotonic()
+        stats = await run_shoppers(customers, products, args.shoppers, args.duration,
+                                   args.think_time, args.ramp_up, seed=args.seed)
+        stats.report(time.monotonic() - started)
+        return
+    rng = random.Random(args.seed) if args.seed is not None else random
+    cart_mgr = make_cart_manager(customers)
     start_date = datetime(2024, 1, 1, tzinfo=timezone.utc)
     end_date = datetime(2025, 1, 1, tzinfo=timezone.utc)
     while True:
         try:
-            async with websockets.connect(WS_URL, ping_interval=10, ping_timeout=5) as ws:
-                print("Connected to WebSocket server")
-                await send_events(ws, customers, products, cart_mgr, start_date, end_date)
+            async with connect_producer() as ws:
+                print(f"Connected to WebSocket server ({wire.codec_for(ws.subprotocol).name})")
+                await send_events(ws, customers, products, cart_mgr, start_date, end_date, rng, args.seed)
         except Exception as e:
             print(f"Connection lost: {e}. Reconnecting in 3 seconds...")
             await asyncio.sleep(3)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.workers > 1 and args.mode != "live":
+        import sharded_simulator
+        sharded_simulator.main(args)
+    else:
+        asyncio.run(main(args))
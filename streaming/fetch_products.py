@@ -1,22 +1,15 @@
-import requests
+import sys
 
-def fetch_products():
-    url = "https://fakestoreapi.com/products"
-    resp = requests.get(url)
-    resp.raise_for_status()
-    products = resp.json()
-    # Extract id, title, price, image URL, and description
-    product_list = [{
-        "id": p["id"],
-        "title": p["title"],
-        "price": p["price"],
-        "image": p["image"],
-        "description": p["description"]
-    } for p in products]
-    return product_list
+from catalog import CATALOG_SNAPSHOT, load_catalog
+from event_simulator import DB_CONFIG
+
+def fetch_products(refresh=False):
+    # Snapshot first, then the products table, then fakestoreapi.com
+    return load_catalog(DB_CONFIG, refresh=refresh)
 
 if __name__ == "__main__":
-    products = fetch_products()
-    print(f"Fetched {len(products)} products")
+    # --refresh ignores a fresh snapshot and rewrites it from the database or API
+    products = fetch_products(refresh="--refresh" in sys.argv[1:])
+    print(f"Fetched {len(products)} products (snapshot: {CATALOG_SNAPSHOT})")
     # Optionally print first product for verification
     print(products[0])
@@ -0,0 +1,233 @@
+"""High-rate load generation against the WebSocket ingest server.
+
+Drives a target event rate for a fixed duration over several concurrent
+producer connections, then reports send latency and achieved throughput
+percentiles. Pacing is open-loop: each connection sends whatever is due on
+a short tick, so a slow server shows up as rising latency and a throughput
+shortfall rather than silently lowering the offered rate.
+
+The shoppers mode instead opens one connection per simulated shopper, each
+owning a shard of customers and pausing for a random think time between
+actions, to exercise the server with many mostly idle sockets.
+
+Run through the simulator:
+    python streaming/event_simulator.py --mode load --rate 5000 --connections 4 --duration 60
+    python streaming/event_simulator.py --mode shoppers --shoppers 2000 --think-time 5 --duration 120
+"""
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+import wire
+from cart_store import make_cart_manager
+from event_simulator import connect_producer, generate_event, index_products
+
+TICK_SECONDS = 0.01
+
+
+class LoadStats:
+    """Send latencies and per-second throughput collected across all connections"""
+
+    def __init__(self):
+        self.latencies = []
+        self.events = 0
+        self.frames = 0
+        self.errors = 0
+        self.per_second = {}
+        self.started = time.monotonic()
+        self.connected = 0
+        self.peak_connections = 0
+        self.connect_failures = 0
+        self.connect_latencies = []
+
+    def connection_opened(self, latency):
+        self.connected += 1
+        self.peak_connections = max(self.peak_connections, self.connected)
+        self.connect_latencies.append(latency)
+
+    def connection_closed(self):
+        self.connected -= 1
+
+    def record(self, latency, events):
+        self.latencies.append(latency)
+        self.frames += 1
+        self.events += events
+        second = int(time.monotonic() - self.started)
+        self.per_second[second] = self.per_second.get(second, 0) + events
+
+    def merge(self, other):
+        """Fold in stats collected elsewhere (e.g. another worker process)"""
+        self.latencies.extend(other.latencies)
+        self.events += other.events
+        self.frames += other.frames
+        self.errors += other.errors
+        self.peak_connections += other.peak_connections
+        self.connect_failures += other.connect_failures
+        self.connect_latencies.extend(other.connect_latencies)
+        for second, count in other.per_second.items():
+            self.per_second[second] = self.per_second.get(second, 0) + count
+
+    def report(self, elapsed, target_rate=None):
+        print("\n=== LOAD TEST RESULTS ===")
+        if target_rate:
+            print(f"Target rate: {target_rate:.0f} events/s")
+        print(f"Sent {self.events} events in {self.frames} frames over {elapsed:.1f}s "
+              f"({self.events / elapsed:.0f} events/s), errors: {self.errors}")
+        if self.connect_latencies:
+            print(f"Connections: peak {self.peak_connections}, failed {self.connect_failures}, "
+                  "connect latency (ms): " + ", ".join(
+                      f"p{p} {percentile(self.connect_latencies, p) * 1000:.1f}" for p in (50, 99, 100)))
+        if self.latencies:
+            print("Send latency (ms): " + ", ".join(
+                f"p{p} {percentile(self.latencies, p) * 1000:.2f}" for p in (50, 90, 99, 100)))
+        # Skip the last, partial second
+        samples = [count for second, count in sorted(self.per_second.items())[:-1]]
+        if samples:
+            print("Throughput (events/s): " + ", ".join(
+                f"p{p} {percentile(samples, p):.0f}" for p in (1, 50, 90, 100)))
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an unsorted list"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def _producer(customers, products, cart_mgr, rate, deadline, batch_size, stats, rng=random,
+                    products_by_id=None):
+    async with connect_producer() as ws:
+        encode = wire.codec_for(ws.subprotocol).encode
+        started = time.monotonic()
+        sent = 0
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            due = int((now - started) * rate) - sent
+            while due > 0:
+                count = min(due, batch_size)
+                timestamp = datetime.now(timezone.utc).isoformat()
+                events = []
+                for _ in range(count):
+                    event = generate_event(rng.choice(customers), cart_mgr, products, rng, products_by_id)
+                    event["timestamp"] = timestamp
+                    events.append(event)
+                frame = encode(events if batch_size > 1 else events[0])
+                send_started = time.perf_counter()
+                await ws.send(frame)
+                stats.record(time.perf_counter() - send_started, count)
+                sent += count
+                due -= count
+            await asyncio.sleep(TICK_SECONDS)
+
+
+def _rng(seed, index):
+    """Independent, reproducible random stream per connection when a seed is given"""
+    return random.Random(f"{seed}:{index}") if seed is not None else random
+
+
+async def run_load_test(customers, products, rate, connections=1, duration=60.0, batch_size=1, stats=None,
+                        seed=None):
+    """Offer ``rate`` events/s for ``duration`` seconds split over ``connections`` producers
+
+    Each producer owns a disjoint customer shard, so with a seed every
+    connection's event sequence is the same from run to run however their
+    sends interleave.
+    """
+    stats = stats or LoadStats()
+    cart_mgr = make_cart_manager(customers)
+    products_by_id = index_products(products)
+    deadline = time.monotonic() + duration
+    print(f"Load test: {rate:.0f} events/s over {connections} connection(s) for {duration:.0f}s, "
+          f"batch size {batch_size}")
+    results = await asyncio.gather(
+        *[_producer(shard, products, cart_mgr, rate / connections, deadline, batch_size, stats, _rng(seed, i),
+                    products_by_id)
+          for i, shard in enumerate(shard_customers(customers, connections))],
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            stats.errors += 1
+            print(f"Producer failed: {result}")
+    return stats
+
+
+def raise_open_file_limit():
+    """Lift the soft file descriptor limit to the hard limit so thousands of sockets fit"""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def shard_customers(customers, shards):
+    """Split customers into disjoint shards; shoppers beyond the customer count reuse one each"""
+    if shards <= len(customers):
+        return [customers[i::shards] for i in range(shards)]
+    return [[customers[i % len(customers)]] for i in range(shards)]
+
+
+async def _shopper(shard, products, cart_mgr, think_time, start_delay, deadline, stats, rng=random,
+                   products_by_id=None):
+    await asyncio.sleep(start_delay)
+    connect_started = time.perf_counter()
+    try:
+        ws = await connect_producer()
+    except Exception as e:
+        stats.connect_failures += 1
+        if stats.connect_failures <= 5:
+            print(f"Shopper failed to connect: {e}")
+        return
+    stats.connection_opened(time.perf_counter() - connect_started)
+    try:
+        encode = wire.codec_for(ws.subprotocol).encode
+        while True:
+            # Exponential think time between actions, like independent shoppers browsing
+            await asyncio.sleep(rng.expovariate(1 / think_time) if think_time > 0 else 0)
+            if time.monotonic() >= deadline:
+                break
+            event = generate_event(rng.choice(shard), cart_mgr, products, rng, products_by_id)
+            event["timestamp"] = datetime.now(timezone.utc).isoformat()
+            send_started = time.perf_counter()
+            await ws.send(encode(event))
+            stats.record(time.perf_counter() - send_started, 1)
+    except Exception:
+        stats.errors += 1
+    finally:
+        stats.connection_closed()
+        await ws.close()
+
+
+async def run_shoppers(customers, products, shoppers, duration=60.0, think_time=5.0, ramp_up=10.0, stats=None,
+                       seed=None):
+    """Simulate ``shoppers`` concurrent connections, each sending events after a think time"""
+    stats = stats or LoadStats()
+    limit = raise_open_file_limit()
+    if limit is not None and limit < shoppers + 64:
+        print(f"Warning: open file limit {limit} is below the {shoppers} requested connections")
+    cart_mgr = make_cart_manager(customers)
+    products_by_id = index_products(products)
+    deadline = time.monotonic() + ramp_up + duration
+    print(f"Shoppers: {shoppers} connections ramping up over {ramp_up:.0f}s, "
+          f"think time {think_time:.1f}s, then {duration:.0f}s steady")
+    shards = shard_customers(customers, shoppers)
+    await asyncio.gather(*[
+        _shopper(shard, products, cart_mgr, think_time, ramp_up * i / shoppers, deadline, stats, _rng(seed, i),
+                 products_by_id)
+        for i, shard in enumerate(shards)
+    ])
+    return stats
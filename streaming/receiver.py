@@ -1,44 +1,112 @@
 import asyncio
 import websockets
-import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import wire
+from event_log import SegmentWriter, read_events
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("receiver")
 
-EVENTS_FILE = "events.json"
+# Append-only JSON Lines segments
+EVENTS_DIR = os.getenv("RECEIVER_EVENTS_DIR", "events")
+
+# Single JSON array written by receivers before the segment log; its events
+# are imported into the log on start and the file is renamed to *.imported
+LEGACY_EVENTS_FILE = os.getenv("RECEIVER_LEGACY_FILE", "events.json")
+
+# When set, closed segments are compacted into date-partitioned Parquet here
+PARQUET_DIR = os.getenv("RECEIVER_PARQUET_DIR")
+COMPACTION_INTERVAL = float(os.getenv("RECEIVER_COMPACTION_INTERVAL", "60"))
+
+# Optional server-side filters, comma-separated (e.g. RECEIVER_ACTIONS=purchase_cart)
+RECEIVER_ACTIONS = os.getenv("RECEIVER_ACTIONS")
+RECEIVER_CUSTOMERS = os.getenv("RECEIVER_CUSTOMERS")
+RECEIVER_PRODUCTS = os.getenv("RECEIVER_PRODUCTS")
+
+# Catch up from the server's replay buffer on connect (number of recent events)
+RECEIVER_REPLAY_LAST = os.getenv("RECEIVER_REPLAY_LAST")
 
 async def receive_events():
     uri = "ws://localhost:8765"
 
-    # Load existing events if the file exists
-    if os.path.exists(EVENTS_FILE):
-        with open(EVENTS_FILE, "r") as f:
-            try:
-                events = json.load(f)
-            except json.JSONDecodeError:
-                events = []
-    else:
-        events = []
-
-    async with websockets.connect(uri, ping_interval=10, ping_timeout=10) as ws:
-        logger.info("Receiver connected to WebSocket server.")
+    uri = wire.with_params(uri, role=wire.SUBSCRIBER, actions=RECEIVER_ACTIONS,
+                           customers=RECEIVER_CUSTOMERS, products=RECEIVER_PRODUCTS,
+                           last=RECEIVER_REPLAY_LAST)
+    async with websockets.connect(uri, ping_interval=10, ping_timeout=10,
+                                  subprotocols=wire.client_subprotocols()) as ws:
+        codec = wire.codec_for(ws.subprotocol)
+        logger.info(f"Receiver connected to WebSocket server ({codec.name}).")
+        loop = asyncio.get_running_loop()
+        # Writes and fsyncs run on one thread of their own: a slow disk does not
+        # block the event loop, and the writer is never used from two threads
+        disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-writer")
+        writer = await loop.run_in_executor(disk, SegmentWriter, EVENTS_DIR)
+        imported = await loop.run_in_executor(disk, import_legacy_events, writer, LEGACY_EVENTS_FILE)
+        if imported:
+            logger.info(f"Imported {imported} events from {LEGACY_EVENTS_FILE}")
+        flusher = asyncio.create_task(_sync_periodically(writer, disk))
+        compactor = asyncio.create_task(_compact_periodically()) if PARQUET_DIR else None
         try:
             async for message in ws:
                 try:
-                    event = json.loads(message)
-                    logger.info(f"Received event {event.get('event_id', 'unknown')}")
-                    events.append(event)
-
-                    # Save all events back to the file
-                    with open(EVENTS_FILE, "w") as f:
-                        json.dump(events, f, indent=2)
+                    payload = codec.decode(message)
+                    # Batch frames carry a JSON array of events
+                    batch = payload if isinstance(payload, list) else [payload]
+                    events = []
+                    for event in batch:
+                        if "type" in event:
+                            # Control message, e.g. replay_complete after catching up
+                            logger.info(f"Server: {event}")
+                            continue
+                        logger.info(f"Received event {event.get('event_id', 'unknown')}")
+                        events.append(event)
+                    if events:
+                        await loop.run_in_executor(disk, writer.write_many, events)
 
-                except json.JSONDecodeError:
-                    logger.warning("Received invalid JSON data.")
+                except (ValueError, TypeError):
+                    logger.warning("Received invalid event data.")
         except websockets.exceptions.ConnectionClosed:
             logger.warning("Connection closed.")
+        finally:
+            flusher.cancel()
+            if compactor is not None:
+                compactor.cancel()
+            await loop.run_in_executor(disk, writer.close)
+            disk.shutdown()
+
+def import_legacy_events(writer, path):
+    """Append the events of a legacy events.json to the segment log, once"""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    for event in read_events(path):
+        writer.write(event)
+        count += 1
+    writer.sync()
+    os.replace(path, path + ".imported")
+    return count
+
+async def _sync_periodically(writer, disk):
+    """Make sure buffered events reach disk even when no new events arrive"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(writer.fsync_interval)
+        await loop.run_in_executor(disk, writer.maybe_sync)
+
+async def _compact_periodically():
+    """Turn closed segments into Parquet in a worker thread"""
+    from compaction import compact_segments  # needs pyarrow, only loaded when enabled
+
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL)
+        try:
+            await loop.run_in_executor(None, compact_segments, EVENTS_DIR, PARQUET_DIR)
+        except Exception as e:
+            logger.warning(f"Compaction failed: {e}")
 
 if __name__ == "__main__":
     asyncio.run(receive_events())
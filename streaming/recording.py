@@ -0,0 +1,153 @@
+"""Record a simulator stream to a file and replay it against the server.
+
+A recording is gzip-compressed JSON Lines; each line is
+``[seconds_since_start, payload]`` where payload is the event or batch of
+events exactly as one frame carried it. Replaying sends the same frames in
+the same order, at the recorded pace (``--speed 1``), faster (``--speed 10``)
+or as fast as the server accepts them (``--speed max``), so server and
+database changes can be benchmarked against identical workloads.
+
+Record with the simulator, then replay:
+    python streaming/event_simulator.py --mode load --rate 2000 --duration 60 --seed 42 --record load.jsonl.gz
+    python streaming/recording.py load.jsonl.gz --speed 10
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import time
+import uuid
+
+import wire
+
+_recorder = None
+
+
+class Recorder:
+    """Appends sent payloads with their time offset to a gzip JSON Lines file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = 0
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._started = time.monotonic()
+
+    def write(self, payload):
+        self._file.write(json.dumps([round(time.monotonic() - self._started, 6), payload],
+                                    separators=(",", ":")))
+        self._file.write("\n")
+        self.frames += 1
+
+    def close(self):
+        self._file.close()
+
+
+class _RecordingSocket:
+    """Producer connection that records each frame before sending it"""
+
+    def __init__(self, ws, recorder):
+        self._ws = ws
+        self._recorder = recorder
+        self._decode = wire.codec_for(ws.subprotocol).decode
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+    async def send(self, message):
+        self._recorder.write(self._decode(message))
+        await self._ws.send(message)
+
+
+class _RecordingConnect:
+    """Wraps ``websockets.connect`` for both ``await`` and ``async with`` use"""
+
+    def __init__(self, connect, recorder):
+        self._connect = connect
+        self._recorder = recorder
+        self._ws = None
+
+    async def _open(self):
+        return _RecordingSocket(await self._connect, self._recorder)
+
+    def __await__(self):
+        return self._open().__await__()
+
+    async def __aenter__(self):
+        self._ws = await self._open()
+        return self._ws
+
+    async def __aexit__(self, *exc_info):
+        await self._ws.close()
+
+
+def start(path):
+    """Record every producer connection opened from now on to ``path``"""
+    global _recorder
+    _recorder = Recorder(path)
+    return _recorder
+
+
+def stop():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        print(f"Recorded {_recorder.frames} frames to {_recorder.path}")
+        _recorder = None
+
+
+def wrap(connect):
+    """Pass a ``websockets.connect`` call through the active recorder, if any"""
+    return _RecordingConnect(connect, _recorder) if _recorder is not None else connect
+
+
+def read_recording(path):
+    """Yield ``(offset_seconds, payload)`` from a recording"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                offset, payload = json.loads(line)
+                yield offset, payload
+
+
+def _fresh_ids(payload):
+    for event in payload if isinstance(payload, list) else [payload]:
+        event["event_id"] = str(uuid.uuid4())
+
+
+async def replay(path, speed=1.0, fresh_ids=False, stats=None):
+    """Send a recording to the server; ``speed`` None replays at maximum rate"""
+    from event_simulator import connect_producer
+    from load_generator import LoadStats
+
+    stats = stats or LoadStats()
+    async with connect_producer() as ws:
+        encode = wire.codec_for(ws.subprotocol).encode
+        started = time.monotonic()
+        for offset, payload in read_recording(path):
+            if speed:
+                delay = started + offset / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if fresh_ids:
+                _fresh_ids(payload)
+            frame = encode(payload)
+            send_started = time.perf_counter()
+            await ws.send(frame)
+            stats.record(time.perf_counter() - send_started, len(payload) if isinstance(payload, list) else 1)
+    return stats
+
+
+def parse_speed(value):
+    return None if value == "max" else float(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded event stream against the WebSocket server")
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="replay speed multiplier, or 'max'")
+    parser.add_argument("--fresh-ids", action="store_true",
+                        help="give events new ids so a replay into the same database is not deduplicated")
+    args = parser.parse_args()
+    started = time.monotonic()
+    stats = asyncio.run(replay(args.recording, args.speed, args.fresh_ids))
+    stats.report(time.monotonic() - started)
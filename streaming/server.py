@@ -1,10 +1,16 @@
 import asyncio
-import json
-import psycopg2
+import signal
+import time
 from datetime import datetime
 import websockets
 import os
 
+import wire
+from abandonment import ABANDON_CHECK_INTERVAL, CartTracker
+from broadcast import Broadcaster, Subscription
+from storage import (AsyncConnectionPool, ensure_abandonment_table, ensure_upcoming_partitions, insert_abandonments,
+                     write_events)
+
 # Database configuration - use environment variables for Docker
 DB_CONFIG = {
     "user": os.getenv("DB_USER", "postgres"),
@@ -18,88 +24,307 @@ DB_CONFIG = {
 WS_HOST = os.getenv("WS_HOST", "0.0.0.0")
 WS_PORT = int(os.getenv("WS_PORT", "8765"))
 
-# Store connected clients
-clients = set()
+# Ingest buffer configuration: flush every N events or T milliseconds
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", "200"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "20000"))
+INGEST_STATS_INTERVAL = float(os.getenv("INGEST_STATS_INTERVAL", "10"))
+
+# How often upcoming monthly events partitions are checked for and created
+PARTITION_CHECK_HOURS = float(os.getenv("EVENTS_PARTITION_CHECK_HOURS", "24"))
+# and how soon a failed check is retried
+PARTITION_RETRY_MINUTES = float(os.getenv("EVENTS_PARTITION_RETRY_MINUTES", "5"))
+
+# Store connected clients and the wire codec each one negotiated
+clients = {}
+
+# Per-subscriber send queues, see broadcast.py for the overflow policies
+broadcaster = Broadcaster()
+
+# Shared database pool, opened in main()
+db_pool = AsyncConnectionPool(DB_CONFIG)
+
+# Open carts and their idle deadlines, see abandonment.py
+cart_tracker = CartTracker()
+
+class IngestBuffer:
+    """Write-behind buffer that stores events in bulk.
+
+    Events are collected in memory and flushed with a single COPY when the
+    buffer reaches ``batch_size`` events or ``flush_ms`` milliseconds have
+    passed. Producers are slowed down once ``max_pending`` events are waiting.
+    """
+
+    def __init__(self, pool, batch_size=INGEST_BATCH_SIZE, flush_ms=INGEST_FLUSH_MS,
+                 max_pending=INGEST_MAX_PENDING, stats_interval=INGEST_STATS_INTERVAL):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_pending = max_pending
+        self.stats_interval = stats_interval
+        self._events = []
+        self._wakeup = None
+        self._drained = None
+        self._closing = False
+        self._task = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.flushes = 0
+        self.flushed_events = 0
+        self.failed_events = 0
+        self.max_flush_size = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._stats_started = time.monotonic()
+
+    def start(self):
+        # Created here so they bind to the running loop (Python 3.9)
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, event_data):
+        """Queue one event, waiting if too many events are already pending"""
+        await self.put_many([event_data])
+
+    async def put_many(self, events):
+        """Queue a batch of events in one step"""
+        while len(self._events) >= self.max_pending:
+            self._drained.clear()
+            await self._drained.wait()
+        self._events.extend(events)
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._events:
+                await self._flush()
+                if len(self._events) < self.batch_size and not self._closing:
+                    break
+            if time.monotonic() - self._stats_started >= self.stats_interval:
+                self.report()
+            if self._closing and not self._events:
+                return
+
+    async def _flush(self):
+        batch = self._events[:self.batch_size]
+        del self._events[:self.batch_size]
+        self._drained.set()
+        started = time.perf_counter()
+        try:
+            rejected = await self.pool.run(write_events, batch)
+        except Exception as e:
+            self.failed_events += len(batch)
+            print(f"Error storing batch of {len(batch)} events: {e}")
+            return
+        latency = time.perf_counter() - started
+        self.failed_events += rejected
+        self.flushes += 1
+        self.flushed_events += len(batch) - rejected
+        self.max_flush_size = max(self.max_flush_size, len(batch))
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def report(self):
+        elapsed = time.monotonic() - self._stats_started
+        if self.flushes:
+            print(
+                f"Ingest: {self.flushed_events} events in {self.flushes} flushes "
+                f"({self.flushed_events / elapsed:.0f} events/s), "
+                f"avg size {self.flushed_events / self.flushes:.0f}, max size {self.max_flush_size}, "
+                f"avg latency {self.total_latency / self.flushes * 1000:.1f}ms, "
+                f"max latency {self.max_latency * 1000:.1f}ms, "
+                f"failed {self.failed_events}, pending {len(self._events)}"
+            )
+        self._reset_stats()
+
+    async def close(self):
+        """Flush everything still buffered and stop the flush task"""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        self.report()
+
+ingest_buffer = IngestBuffer(db_pool)
+
+def _request_path(websocket):
+    """Handshake path (with query string) for both websockets server implementations"""
+    request = getattr(websocket, "request", None)
+    if request is not None:
+        return request.path
+    return getattr(websocket, "path", "/")
+
+def _replay_params(params):
+    """Catch-up request from the handshake: from_offset, last (events) or since (seconds)
+
+    Raises ValueError unless every given value is a non-negative number
+    (an integer for from_offset and last).
+    """
+    replay = {}
+    for name, convert in (("from_offset", int), ("last", int), ("since", float)):
+        if params.get(name):
+            try:
+                value = convert(params[name])
+            except ValueError:
+                value = None
+            if value is None or not 0 <= value < float("inf"):
+                raise ValueError(f"{name} must be a non-negative number, got '{params[name][:40]}'")
+            replay[name] = value
+    return replay
 
 async def handle_client(websocket, path):
     path = path[0] if isinstance(path, (list, tuple)) else path
-    clients.add(websocket)
-    print(f"Client connected. Total clients: {len(clients)}")
+    params = wire.handshake_params(path or _request_path(websocket))
+    role = params.get("role", wire.SUBSCRIBER)
+    if role not in wire.ROLES:
+        await websocket.close(code=1008, reason=f"unknown role '{role}'")
+        return
+    # store=0 marks traffic that is already persisted elsewhere (e.g. backfill.py --broadcast)
+    store = params.get("store", "1") != "0"
+    # Validated before anything is registered, so a bad request leaves nothing behind
     try:
+        replay = _replay_params(params) if role == wire.SUBSCRIBER else {}
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    codec = wire.codec_for(websocket.subprotocol)
+    try:
+        clients[websocket] = codec
+        # Only subscribers receive broadcasts; producers are never sent their own events back
+        if role == wire.SUBSCRIBER:
+            subscription = Subscription.from_params(params)
+            broadcaster.add(websocket, codec, subscription)
+            role = f"{role}: {subscription}"
+            if replay:
+                replayed = broadcaster.catch_up(websocket, **replay)
+                role = f"{role}, replayed {replayed}"
+        print(f"Client connected ({role}, {codec.name}). Total clients: {len(clients)}, "
+              f"subscribers: {len(broadcaster.subscribers)}")
         async for message in websocket:
-            event_data = json.loads(message)
-            await store_event(event_data)
-            await broadcast_event(event_data)
+            event_data = codec.decode(message)
+            if isinstance(event_data, list):
+                # Batch frame: a JSON array of events sent as one message
+                if store:
+                    cart_tracker.observe_many(event_data)
+                    await ingest_buffer.put_many(event_data)
+            elif store:
+                cart_tracker.observe(event_data)
+                await ingest_buffer.put(event_data)
+            # Subscribers on the same codec get the producer's frame as-is
+            broadcast_event(event_data, raw=message, raw_codec=codec)
     except websockets.exceptions.ConnectionClosed:
         print("Client disconnected")
     except Exception as e:
         print(f"Error handling client: {e}")
     finally:
-        clients.remove(websocket)
+        clients.pop(websocket, None)
+        await broadcaster.remove(websocket)
         print(f"Client disconnected. Total clients: {len(clients)}")
 
 # Wrapper function to handle the argument mismatch
 async def handle_client_wrapper(websocket):
     await handle_client(websocket, None)
 
-async def store_event(event_data):
-    """Store event data in PostgreSQL database"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        
-        # Insert event into database
-        cur.execute("""
-            INSERT INTO events (
-                event_id, customer_id, product_id, product_title, 
-                product_price, product_image, action, description, timestamp
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            event_data.get('event_id'),
-            event_data.get('customer_id'),
-            event_data.get('product_id'),
-            event_data.get('title'),
-            event_data.get('product_price'),
-            event_data.get('product_image'),
-            event_data.get('action'),
-            event_data.get('description'),
-            event_data.get('timestamp')
-        ))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-    except Exception as e:
-        print(f"Error storing event: {e}")
+def broadcast_event(event_data, raw=None, raw_codec=None):
+    """Broadcast an event (or a batch of events) to all connected WebSocket clients
+
+    Each client has its own send queue, so this never waits for a slow consumer.
+    ``raw`` is the frame the event arrived in, encoded with ``raw_codec``. It is
+    forwarded unchanged to clients using that codec, so only the storage path
+    pays for decoding. Pass it only when ``event_data`` has not been modified.
+    """
+    broadcaster.publish(event_data, raw, raw_codec)
 
-async def broadcast_event(event_data):
-    """Broadcast event to all connected WebSocket clients"""
-    if clients:
-        message = json.dumps(event_data)
-        await asyncio.gather(
-            *[client.send(message) for client in clients],
-            return_exceptions=True
-        )
+def serve(host, port):
+    """WebSocket server for handle_client; clients offering no subprotocol get JSON"""
+    return websockets.serve(handle_client_wrapper, host, port,
+                            subprotocols=wire.server_subprotocols(),
+                            select_subprotocol=wire.select_subprotocol)
+
+async def run_abandonment_checks():
+    """Flag carts idle past the threshold, then broadcast and store the abandonments"""
+    while True:
+        await asyncio.sleep(ABANDON_CHECK_INTERVAL)
+        abandoned = cart_tracker.expire()
+        if not abandoned:
+            continue
+        broadcast_event(abandoned)
+        try:
+            await db_pool.run(insert_abandonments, abandoned)
+        except Exception as e:
+            print(f"Error storing {len(abandoned)} cart abandonments: {e}")
+        print(f"Abandoned carts: {len(abandoned)} flagged, {len(cart_tracker)} carts open")
+
+async def run_partition_maintenance():
+    """Keep the next months' events partitions created so new events skip events_default"""
+    while True:
+        try:
+            created = await db_pool.run(ensure_upcoming_partitions)
+        except Exception as e:
+            print(f"Error creating events partitions: {e}, retrying in {PARTITION_RETRY_MINUTES:g} minutes")
+            await asyncio.sleep(PARTITION_RETRY_MINUTES * 60)
+            continue
+        if created is None:
+            print("Events table is not partitioned, skipping partition maintenance")
+            return
+        if created:
+            print(f"Created {created} events partition(s)")
+        await asyncio.sleep(PARTITION_CHECK_HOURS * 3600)
 
 async def main():
     """Main WebSocket server function"""
     print(f"Starting WebSocket server on {WS_HOST}:{WS_PORT}")
     print(f"Database config: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}")
     
-    # Test database connection
+    print(f"Database pool: size {db_pool.min_size}-{db_pool.max_size}, "
+          f"acquire timeout {db_pool.acquire_timeout}s, statement timeout {db_pool.statement_timeout_ms}ms")
+    
+    # Open the connection pool (also tests the database connection)
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        conn.close()
+        await db_pool.open()
+        await db_pool.run(ensure_abandonment_table)
         print("Database connection successful")
     except Exception as e:
         print(f"Database connection failed: {e}")
         return
     
-    # Start WebSocket server with wrapper function
-    async with websockets.serve(handle_client_wrapper, WS_HOST, WS_PORT) as server:
-        print(f"WebSocket server is running on ws://{WS_HOST}:{WS_PORT}")
-        await asyncio.Future()  # Keep server running indefinitely
+    print(f"Ingest buffer: flush every {ingest_buffer.batch_size} events or {INGEST_FLUSH_MS}ms")
+    ingest_buffer.start()
+    print(f"Broadcast queues: {broadcaster.max_queue} frames per client, overflow policy '{broadcaster.overflow}'")
+    print(f"Replay buffer: last {broadcaster.replay.size} events")
+    lag_reporter = asyncio.create_task(broadcaster.run_reporter())
+    print(f"Abandoned carts: flagged after {cart_tracker.idle_seconds:.0f}s idle, checked every {ABANDON_CHECK_INTERVAL}s")
+    abandonment_checker = asyncio.create_task(run_abandonment_checks())
+    partition_maintainer = asyncio.create_task(run_partition_maintenance())
+    
+    # Stop cleanly on SIGTERM (docker stop) as well as Ctrl+C
+    stop = asyncio.get_running_loop().create_future()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set_result, None)
+    except (NotImplementedError, RuntimeError):
+        pass  # Signal handlers are not available on Windows
+    
+    try:
+        # Start WebSocket server with wrapper function
+        async with serve(WS_HOST, WS_PORT) as server:
+            print(f"WebSocket server is running on ws://{WS_HOST}:{WS_PORT}")
+            print(f"Wire codecs: {', '.join(c.name for c in wire.CODECS)}")
+            await stop  # Keep server running until asked to stop
+    finally:
+        print("Shutting down, draining ingest buffer...")
+        lag_reporter.cancel()
+        abandonment_checker.cancel()
+        partition_maintainer.cancel()
+        await ingest_buffer.close()
+        await db_pool.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
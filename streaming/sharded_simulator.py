@@ -0,0 +1,95 @@
+"""Multi-process simulator: one worker process per disjoint customer shard.
+
+A single asyncio process tops out on one core. The launcher forks
+``--workers`` processes; each owns its own slice of the customers and its own
+``CartManager``, so a customer's cart only ever changes in one process and
+cart semantics stay consistent. Each worker runs the load or shoppers mode on
+its shard and sends its ``LoadStats`` back over a queue, where they are merged
+into one report.
+
+Run through the simulator:
+    python streaming/event_simulator.py --mode load --workers 8 --rate 40000 --connections 16 --duration 60
+    python streaming/event_simulator.py --mode shoppers --workers 4 --shoppers 8000
+"""
+import asyncio
+import multiprocessing
+import queue
+import time
+
+from event_simulator import fetch_products, load_customers_for
+from load_generator import LoadStats, run_load_test, run_shoppers, shard_customers
+
+
+def split_evenly(total, parts):
+    """Integer shares of ``total`` that differ by at most one"""
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def _worker(index, shard, products, args, connections, shoppers, started, results):
+    stats = LoadStats()
+    # Shared origin so per-second throughput buckets line up across workers
+    stats.started = started
+    seed = f"{args.seed}-{index}" if args.seed is not None else None
+    try:
+        if args.mode == "load":
+            asyncio.run(run_load_test(shard, products, args.rate / args.workers, connections,
+                                      args.duration, args.batch_size, stats, seed))
+        else:
+            asyncio.run(run_shoppers(shard, products, shoppers, args.duration,
+                                     args.think_time, args.ramp_up, stats, seed))
+    except Exception as e:
+        stats.errors += 1
+        print(f"Worker {index} failed: {e}")
+    except KeyboardInterrupt:
+        pass
+    results.put(stats)
+
+
+def run_sharded(customers, products, args):
+    """Run ``args.workers`` processes over disjoint customer shards; returns merged stats"""
+    workers = min(args.workers, len(customers))
+    args.workers = workers
+    shards = shard_customers(customers, workers)
+    connections = [max(1, n) for n in split_evenly(args.connections, workers)]
+    shoppers = split_evenly(args.shoppers, workers)
+    print(f"Sharded simulator: {workers} worker processes, "
+          f"{min(len(s) for s in shards)}-{max(len(s) for s in shards)} customers each")
+
+    results = multiprocessing.Queue()
+    started = time.monotonic()
+    processes = [
+        multiprocessing.Process(
+            target=_worker,
+            args=(i, shards[i], products, args, connections[i], shoppers[i], started, results),
+            name=f"simulator-{i}",
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    stats = LoadStats()
+    stats.started = started
+    collected = 0
+    while collected < workers:
+        try:
+            stats.merge(results.get(timeout=1))
+            collected += 1
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes) and results.empty():
+                break
+    for process in processes:
+        process.join()
+    lost = workers - collected
+    if lost:
+        stats.errors += lost
+        print(f"{lost} worker(s) exited without reporting stats")
+    return stats, time.monotonic() - started
+
+
+def main(args):
+    print(f"Starting sharded event simulator ({args.mode} mode)...")
+    products = fetch_products()
+    customers = load_customers_for()
+    stats, elapsed = run_sharded(customers, products, args)
+    stats.report(elapsed, args.rate if args.mode == "load" else None)
@@ -0,0 +1,467 @@
+"""PostgreSQL access for the streaming services.
+
+psycopg2 is a blocking driver, so every database call is pushed onto a small
+thread pool and the asyncio event loop only ever awaits the result. Connections
+come from a fixed-size pool instead of being opened per event.
+"""
+import asyncio
+import io
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import Json, execute_values
+
+# Pool configuration - use environment variables for Docker
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "5"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+# Monthly events partitions to keep created ahead of the current month
+PARTITION_MONTHS_AHEAD = int(os.getenv("EVENTS_PARTITION_MONTHS_AHEAD", "3"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the acquire timeout."""
+
+
+class AsyncConnectionPool:
+    """Fixed-size psycopg2 pool whose work runs off the event loop."""
+
+    def __init__(self, db_config, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 acquire_timeout=POOL_ACQUIRE_TIMEOUT, statement_timeout_ms=STATEMENT_TIMEOUT_MS):
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.statement_timeout_ms = statement_timeout_ms
+        self._pool = None
+        self._slots = None
+        self._executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix="db")
+
+    async def open(self):
+        """Create the pool; raises if the database is unreachable."""
+        loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_size)
+        self._pool = await loop.run_in_executor(self._executor, self._create_pool)
+
+    def _create_pool(self):
+        return pg_pool.ThreadedConnectionPool(
+            self.min_size,
+            self.max_size,
+            options=f"-c statement_timeout={self.statement_timeout_ms}",
+            **self.db_config,
+        )
+
+    async def run(self, fn, *args):
+        """Call ``fn(conn, *args)`` on a pooled connection in a worker thread.
+
+        The transaction is committed if ``fn`` returns and rolled back if it
+        raises. Waiting for a free connection is bounded by ``acquire_timeout``.
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No database connection available after {self.acquire_timeout}s")
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._run_sync, fn, args)
+        finally:
+            self._slots.release()
+
+    def _run_sync(self, fn, args):
+        conn = self._pool.getconn()
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            # Broken connections are discarded so the pool reconnects lazily
+            self._pool.putconn(conn, close=bool(conn.closed))
+
+    async def close(self):
+        if self._pool is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._pool.closeall)
+            self._pool = None
+        self._executor.shutdown(wait=False)
+
+
+# Column order used for every bulk write into the events table
+EVENT_COLUMNS = ("event_id", "customer_id", "product_id", "product_price", "action", "timestamp")
+
+# Positions of (timestamp, action, product_id, product_price, customer_id, event_id) in
+# EVENT_COLUMNS, the fields update_rollups and update_cart_states read from each stored row
+ROLLUP_FIELDS = tuple(EVENT_COLUMNS.index(c) for c in
+                      ("timestamp", "action", "product_id", "product_price", "customer_id", "event_id"))
+
+
+class ProductCache:
+    """Product title -> ``products.product_id``, shared by every write on this process.
+
+    Loaded from the products table on first use. Titles that are not there
+    yet are added with one upsert, committed on their own so the ids stay
+    valid even when the events batch that introduced them is rolled back.
+    """
+
+    def __init__(self):
+        self.ids = None
+
+    def resolve(self, conn, products):
+        """``{title: product_id}`` covering ``products``, a dict of title -> (price, description, image)"""
+        with conn.cursor() as cur:
+            if self.ids is None:
+                cur.execute("SELECT title, product_id FROM products")
+                self.ids = dict(cur.fetchall())
+            missing = [(title, price or 0, description, image)
+                       for title, (price, description, image) in products.items() if title not in self.ids]
+            if missing:
+                rows = execute_values(
+                    cur,
+                    "INSERT INTO products (title, price, description, image_url) VALUES %s "
+                    "ON CONFLICT (title) DO UPDATE SET title = EXCLUDED.title RETURNING title, product_id",
+                    missing,
+                    fetch=True,
+                )
+                conn.commit()
+                self.ids.update(rows)
+        return self.ids
+
+
+product_cache = ProductCache()
+
+
+def catalog_with_db_ids(conn, products):
+    """Copies of catalog product dicts with ``id`` set to their ``products.product_id``"""
+    ids = product_cache.resolve(conn, {p["title"]: (p.get("price"), p.get("description"), p.get("image"))
+                                       for p in products})
+    return [dict(p, id=ids[p["title"]]) for p in products]
+
+
+def event_rows(conn, events):
+    """Map wire-format event dicts onto EVENT_COLUMNS, resolving product titles to ids.
+
+    Events that name a product by title get its ``products.product_id``;
+    events carrying only a ``product_id`` keep it as sent.
+    """
+    ids = product_cache.resolve(conn, {e["title"]: (e.get("product_price"), None, e.get("product_image"))
+                                       for e in events if e.get("title")})
+    return [
+        (
+            e.get("event_id"),
+            e.get("customer_id"),
+            ids[e["title"]] if e.get("title") else e.get("product_id"),
+            e.get("product_price"),
+            e.get("action"),
+            e.get("timestamp"),
+        )
+        for e in events
+    ]
+
+
+def _copy_field(value):
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(conn, rows, table="events", columns=EVENT_COLUMNS):
+    """Bulk load row tuples with a single COPY ... FROM STDIN"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_field(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def stored_fields(rows):
+    """(timestamp, action, product id, price, customer, event id) of each EVENT_COLUMNS row"""
+    return [tuple(row[i] for i in ROLLUP_FIELDS) for row in rows]
+
+
+def insert_rows(conn, rows):
+    """Multi-row INSERT that skips events which are already stored; returns stored_fields of those inserted"""
+    with conn.cursor() as cur:
+        return execute_values(
+            cur,
+            f"INSERT INTO events ({', '.join(EVENT_COLUMNS)}) VALUES %s ON CONFLICT DO NOTHING "
+            "RETURNING timestamp, action, product_id, product_price, customer_id, event_id",
+            rows,
+            page_size=1000,
+            fetch=True,
+        )
+
+
+def insert_valid_rows(conn, rows):
+    """insert_rows, bisecting the batch around rows the database rejects.
+
+    Each attempt runs inside a savepoint, so a bad row (unknown customer,
+    missing timestamp, malformed event_id) only undoes its own half of the
+    batch. Returns (insert_rows results for the inserted rows, [(row, error)] rejected).
+    """
+    with conn.cursor() as cur:
+        cur.execute("SAVEPOINT insert_rows")
+        try:
+            inserted = insert_rows(conn, rows)
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT insert_rows")
+            cur.execute("RELEASE SAVEPOINT insert_rows")
+            if len(rows) == 1:
+                return [], [(rows[0], e)]
+            middle = len(rows) // 2
+            inserted, rejected = insert_valid_rows(conn, rows[:middle])
+            more_inserted, more_rejected = insert_valid_rows(conn, rows[middle:])
+            return inserted + more_inserted, rejected + more_rejected
+        cur.execute("RELEASE SAVEPOINT insert_rows")
+    return inserted, []
+
+
+def update_rollups(conn, rows):
+    """Add stored events to event_rollup_hourly in the caller's transaction.
+
+    ``rows`` are stored_fields tuples; the event id is not needed here.
+    They are grouped in SQL and merged into existing hours with one upsert, so
+    the rollups stay consistent with exactly the events that were written.
+    """
+    if not rows:
+        return
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO event_rollup_hourly AS r
+                (hour_bucket, action, product_id, event_count, price_sum, customer_sketch)
+            SELECT DATE_TRUNC('hour', COALESCE(ts, LOCALTIMESTAMP)), action, COALESCE(product_id, 0), COUNT(*),
+                   COALESCE(SUM(price), 0), BIT_OR(customer_sketch(customer_id))
+            FROM (VALUES %s) AS v(ts, action, product_id, price, customer_id)
+            GROUP BY 1, 2, 3
+            ON CONFLICT (hour_bucket, action, product_id) DO UPDATE SET
+                event_count = r.event_count + EXCLUDED.event_count,
+                price_sum = r.price_sum + EXCLUDED.price_sum,
+                customer_sketch = r.customer_sketch | EXCLUDED.customer_sketch
+            """,
+            [row[:5] for row in rows],
+            template="(%s::timestamp, %s, %s::int, %s::numeric, %s::bigint)",
+            # One statement per batch, since an upsert cannot touch the same row twice
+            page_size=max(len(rows), 1),
+        )
+
+
+def _timestamp_key(value):
+    """Naive datetime as Postgres stores an event timestamp (any offset is dropped), or None"""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def update_cart_states(conn, rows):
+    """Apply stored events to customer_cart_state in the caller's transaction.
+
+    ``rows`` are stored_fields tuples, already inserted into events. The
+    touched customers' rows are created if needed and locked in customer
+    order (so concurrent writers cannot deadlock). Each customer's events are
+    replayed onto its row in (timestamp, event_id) order, the order
+    rebuild_cart_states() uses, and the results written back in one UPDATE.
+    A customer with an event no later than its stored state (a backfill of an
+    earlier range, say) is rebuilt from the events table instead, since
+    replaying that event on top of newer ones would corrupt the cart.
+    """
+    customers = sorted({int(row[4]) for row in rows if row[4] is not None})
+    if not customers:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO customer_cart_state (customer_id) SELECT unnest(%s::int[]) ON CONFLICT DO NOTHING",
+            (customers,),
+        )
+        cur.execute(
+            "SELECT customer_id, cart_items, cart_events, lifetime_purchases, "
+            "GREATEST(last_activity, last_purchase_at) FROM customer_cart_state "
+            "WHERE customer_id = ANY(%s) ORDER BY customer_id FOR UPDATE",
+            (customers,),
+        )
+        # customer -> [items, cart events, purchases, last activity, last purchase]
+        states = {}
+        latest = {}
+        for cid, items, events, purchases, latest_at in cur.fetchall():
+            states[cid] = [items, events, purchases, None, None]
+            latest[cid] = latest_at
+        ordered = []
+        rebuild = set()
+        for row in rows:
+            if row[4] is None:
+                continue
+            cid = int(row[4])
+            timestamp = _timestamp_key(row[0])
+            if timestamp is None or (latest[cid] is not None and timestamp <= latest[cid]):
+                rebuild.add(cid)
+            ordered.append((timestamp, _uuid_key(row[5]) or "", cid, row))
+        ordered = [item for item in ordered if item[2] not in rebuild]
+        ordered.sort(key=lambda item: item[:2])
+        for _, _, cid, (timestamp, action, product_id, price, _, _) in ordered:
+            state = states[cid]
+            items = state[0]
+            if action == "purchase_cart":
+                items.clear()
+                state[2] += 1
+                state[4] = timestamp
+            elif action in ("add_to_cart", "remove_from_cart"):
+                state[1] += 1
+                state[3] = timestamp
+                if product_id is None:
+                    continue
+                # Net quantity and highest price since the last purchase, as
+                # rebuild_cart_states() sums them; only positive ones are in the cart
+                item = items.setdefault(str(product_id), [0, None])  # JSON object keys are strings
+                item[0] += 1 if action == "add_to_cart" else -1
+                if price is not None and (item[1] is None or float(price) > item[1]):
+                    item[1] = float(price)
+        if rebuild:
+            cur.execute("SELECT rebuild_cart_states(%s::int[])", (sorted(rebuild),))
+            for cid in rebuild:
+                del states[cid]
+        if not states:
+            return
+        execute_values(
+            cur,
+            """
+            UPDATE customer_cart_state AS s SET
+                cart_items = v.cart_items, item_count = v.item_count, open_cart_value = v.open_cart_value,
+                cart_events = v.cart_events, lifetime_purchases = v.lifetime_purchases,
+                last_activity = GREATEST(s.last_activity, v.last_activity),
+                last_purchase_at = GREATEST(s.last_purchase_at, v.last_purchase_at)
+            FROM (VALUES %s) AS v(customer_id, cart_items, item_count, open_cart_value, cart_events,
+                                  lifetime_purchases, last_activity, last_purchase_at)
+            WHERE s.customer_id = v.customer_id
+            """,
+            [(cid, Json(items), sum(q for q, _ in items.values() if q > 0),
+              round(sum(q * (p or 0) for q, p in items.values() if q > 0), 2), events, purchases, last_activity,
+              last_purchase)
+             for cid, (items, events, purchases, last_activity, last_purchase) in states.items()],
+            template="(%s, %s::jsonb, %s, %s::numeric, %s, %s, %s::timestamp, %s::timestamp)",
+            page_size=max(len(states), 1),
+        )
+
+
+# Request context fields, stored in event_context for the few events that carry them
+CONTEXT_FIELDS = ("session_id", "user_agent", "ip_address")
+
+
+def _uuid_key(value):
+    """Canonical text of an event_id as Postgres returns it, or None if it is not a UUID"""
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+def insert_event_context(conn, events):
+    """Store the request context of the events that have any; most batches have none"""
+    rows = [(e.get("event_id"), e.get("timestamp"), *(e.get(f) for f in CONTEXT_FIELDS))
+            for e in events if any(e.get(f) for f in CONTEXT_FIELDS)]
+    if not rows:
+        return
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            "INSERT INTO event_context (event_id, timestamp, session_id, user_agent, ip_address) "
+            "VALUES %s ON CONFLICT DO NOTHING",
+            rows,
+        )
+
+
+def write_events(conn, events):
+    """Write a batch of events, their rollups and cart states in one transaction.
+
+    COPY is tried first; if it fails (typically a duplicate event_id from a
+    producer that reconnected and resent) the batch falls back to a multi-row
+    INSERT that skips the conflicting rows instead of losing the whole batch.
+    Rows the database rejects outright are logged and dropped on their own.
+    Only the rows actually stored are added to the rollups, cart states and
+    event_context, so a resent duplicate cannot attach context to the stored
+    event. Returns the number of rejected events.
+    """
+    rows = event_rows(conn, events)
+    rejected = []
+    try:
+        copy_rows(conn, rows)
+        stored = stored_fields(rows)
+    except Exception as e:
+        print(f"COPY failed ({e}), retrying batch of {len(events)} with INSERT")
+        conn.rollback()
+        inserted, rejected = insert_valid_rows(conn, rows)
+        for row, error in rejected:
+            print(f"Rejected event {row[0]}: {str(error).strip()}")
+        stored = inserted
+        inserted_ids = {row[5] for row in inserted}
+        events = [e for e in events if _uuid_key(e.get("event_id")) in inserted_ids]
+    update_rollups(conn, stored)
+    update_cart_states(conn, stored)
+    insert_event_context(conn, events)
+    return len(rejected)
+
+
+def ensure_event_partitions(conn, from_date, to_date):
+    """Create missing monthly events partitions for [from_date, to_date).
+
+    Returns the number created, or None when the events table is not
+    partitioned (a database initialised before partitioning was added).
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regprocedure('create_events_partitions(date, date)')")
+        if cur.fetchone()[0] is None:
+            return None
+        cur.execute("SELECT create_events_partitions(%s, %s)", (from_date, to_date))
+        return cur.fetchone()[0]
+
+
+def ensure_upcoming_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Partitions from the current month through ``months_ahead`` months later"""
+    this_month = date.today().replace(day=1)
+    month = this_month.year * 12 + this_month.month + months_ahead
+    return ensure_event_partitions(conn, this_month, date(month // 12, month % 12 + 1, 1))
+
+
+def ensure_table(conn, name):
+    """Fail early with a clear message when db/init_postgres.sql has not created ``name``"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        if cur.fetchone()[0] is None:
+            raise RuntimeError(f"Table {name} does not exist; run db/init_postgres.py")
+
+
+def ensure_abandonment_table(conn):
+    ensure_table(conn, "cart_abandonments")
+
+
+def insert_abandonments(conn, abandonments):
+    """Store ``cart_abandoned`` events from abandonment.CartTracker"""
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            "INSERT INTO cart_abandonments (abandonment_id, customer_id, abandoned_at, last_activity, "
+            "item_count, cart_value, products) VALUES %s ON CONFLICT DO NOTHING",
+            [(a["event_id"], a["customer_id"], a["timestamp"], a.get("last_activity"), a["cart_items"],
+              a["cart_value"], ", ".join(a["products"])) for a in abandonments],
+        )
@@ -0,0 +1,108 @@
+"""Wire codecs for event traffic, negotiated through the WebSocket subprotocol.
+
+Clients offer the subprotocols they can speak when connecting and the server
+picks one; the chosen codec is then used for every frame in both directions.
+Connections that negotiate nothing (older clients, browsers) get stdlib JSON
+text frames, so the fallback is always the original protocol. Everything else
+a client declares at connect time (its role, later its subscriptions) travels
+as query parameters on the handshake URL.
+"""
+import json
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Connection roles declared in the handshake query string (?role=...)
+PRODUCER = "producer"
+SUBSCRIBER = "subscriber"
+ROLES = (PRODUCER, SUBSCRIBER)
+
+# Client-side preference, e.g. WIRE_CODEC=json to force plain JSON frames
+WIRE_CODEC = os.getenv("WIRE_CODEC", "")
+
+
+class Codec:
+    """Encoder/decoder pair for one subprotocol"""
+
+    def __init__(self, name, encode, decode):
+        self.name = name
+        self.subprotocol = f"events.{name}"
+        self.encode = encode
+        self.decode = decode
+
+    def __repr__(self):
+        return f"Codec({self.name!r})"
+
+
+JSON = Codec("json", json.dumps, json.loads)
+
+# Available codecs in order of preference; stdlib JSON is always last
+CODECS = []
+if msgpack is not None:
+    CODECS.append(Codec(
+        "msgpack",
+        lambda obj: msgpack.packb(obj, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False),
+    ))
+if orjson is not None:
+    CODECS.append(Codec("orjson", orjson.dumps, orjson.loads))
+CODECS.append(JSON)
+
+_BY_SUBPROTOCOL = {codec.subprotocol: codec for codec in CODECS}
+
+
+def server_subprotocols():
+    """Subprotocols the server accepts, most preferred first"""
+    return [codec.subprotocol for codec in CODECS]
+
+
+def select_subprotocol(first, second):
+    """Server-side negotiation: the client's first supported offer, or None without one.
+
+    websockets 14+ calls this as ``(connection, client_offers)`` and older
+    releases as ``(client_offers, server_subprotocols)``. Returning None
+    instead of refusing the handshake lets clients that offer nothing
+    connect and use JSON.
+    """
+    offered = second if hasattr(first, "request") or hasattr(first, "remote_address") else first
+    for subprotocol in offered or ():
+        if subprotocol in _BY_SUBPROTOCOL:
+            return subprotocol
+    return None
+
+
+def client_subprotocols(preferred=WIRE_CODEC):
+    """Subprotocols a client offers; ``preferred`` narrows the offer to one codec plus JSON"""
+    if preferred:
+        offer = [codec for codec in CODECS if codec.name == preferred]
+        if not offer:
+            print(f"Wire codec '{preferred}' is not available, falling back to JSON")
+        return [codec.subprotocol for codec in offer if codec is not JSON] + [JSON.subprotocol]
+    return server_subprotocols()
+
+
+def codec_for(subprotocol):
+    """Codec for a negotiated subprotocol (JSON when none was negotiated)"""
+    return _BY_SUBPROTOCOL.get(subprotocol, JSON)
+
+
+def with_params(url, **params):
+    """Add handshake parameters such as ``role`` to a WebSocket URL"""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({key: value for key, value in params.items() if value is not None})
+    return urlunsplit(parts._replace(path=parts.path or "/", query=urlencode(query)))
+
+
+def handshake_params(path):
+    """Parse the query string of a handshake request path"""
+    return dict(parse_qsl(urlsplit(path or "/").query))
@@ -0,0 +1,82 @@
+"""Idle-cart expiry of the streaming abandonment tracker, on a fake clock."""
+from datetime import datetime, timedelta, timezone
+
+from abandonment import ABANDONED, CartTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _tracker(idle_seconds=60):
+    clock = FakeClock()
+    return CartTracker(idle_seconds=idle_seconds, clock=clock), clock
+
+
+def _event(customer, action, product=1, price=10.0, timestamp=None):
+    return {"customer_id": customer, "action": action, "product_id": product, "product_price": price,
+            "timestamp": timestamp}
+
+
+def test_idle_cart_expires_once():
+    tracker, clock = _tracker()
+    tracker.observe(_event(1, "add_to_cart", product=1, price=10.0))
+    tracker.observe(_event(1, "add_to_cart", product=2, price=2.5))
+    tracker.observe(_event(1, "add_to_cart", product=2, price=2.5))
+    clock.now = 59
+    assert tracker.expire() == []
+    clock.now = 60
+    [event] = tracker.expire()
+    assert event["action"] == ABANDONED and event["customer_id"] == 1
+    assert (event["cart_items"], event["cart_value"], event["products"]) == (3, 15.0, ["1", "2"])
+    assert len(tracker) == 0 and tracker.abandoned == 1
+    clock.now = 500
+    assert tracker.expire() == []
+
+
+def test_activity_pushes_the_deadline_back():
+    tracker, clock = _tracker()
+    tracker.observe(_event(1, "add_to_cart"))
+    clock.now = 50
+    tracker.observe(_event(1, "add_to_cart", product=2))
+    clock.now = 60
+    assert tracker.expire() == []
+    assert len(tracker._heap) == 1
+    clock.now = 110
+    assert [event["customer_id"] for event in tracker.expire()] == [1]
+
+
+def test_purchased_and_emptied_carts_never_expire():
+    tracker, clock = _tracker()
+    tracker.observe(_event(1, "add_to_cart"))
+    tracker.observe(_event(1, "purchase_cart"))
+    tracker.observe(_event(2, "add_to_cart", product=4))
+    tracker.observe(_event(2, "remove_from_cart", product=4))
+    tracker.observe(_event(3, "remove_from_cart", product=4))
+    clock.now = 1000
+    assert tracker.expire() == []
+    assert len(tracker) == 0
+
+
+def test_expire_uses_the_given_time():
+    tracker, clock = _tracker()
+    tracker.observe(_event(1, "add_to_cart"))
+    clock.now = 10
+    tracker.observe(_event(2, "add_to_cart"))
+    assert [event["customer_id"] for event in tracker.expire(now=65)] == [1]
+    assert [event["customer_id"] for event in tracker.expire(now=70)] == [2]
+
+
+def test_replayed_history_is_ignored():
+    tracker, _ = _tracker()
+    old = datetime.now(timezone.utc) - timedelta(hours=1)
+    tracker.observe(_event(1, "add_to_cart", timestamp=old.isoformat()))
+    tracker.observe(_event(2, "add_to_cart", timestamp=datetime.now(timezone.utc).isoformat()))
+    # Naive timestamps are local time, as a producer's datetime.now() sends them
+    tracker.observe(_event(3, "add_to_cart", timestamp=datetime.now().isoformat()))
+    tracker.observe(_event(4, "add_to_cart", timestamp=(datetime.now() - timedelta(hours=1)).isoformat()))
+    assert sorted(tracker.carts) == [2, 3]
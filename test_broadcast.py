@@ -0,0 +1,128 @@
+"""Filter index, batch subsetting and replay offsets of the broadcaster (no server needed)."""
+import asyncio
+
+import pytest
+
+import wire
+from broadcast import Broadcaster, ReplayBuffer, Subscription
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+def _event(n, action="add_to_cart", customer=1, product=1):
+    return {"event_id": f"e{n}", "action": action, "customer_id": customer, "product_id": product}
+
+
+def _published(filters, payload):
+    """Publish ``payload`` to one subscriber per filter dict; returns the frames each one got queued"""
+    async def run():
+        broadcaster = Broadcaster()
+        subscribers = [broadcaster.add(FakeWebSocket(), wire.JSON, Subscription.from_params(params))
+                       for params in filters]
+        broadcaster.publish(payload)
+        queued = [[frame.payload for frame in subscriber.queue] for subscriber in subscribers]
+        for subscriber in subscribers:
+            await broadcaster.remove(subscriber.websocket)
+        return queued
+    return asyncio.run(run())
+
+
+def test_match_needs_every_filtered_dimension():
+    event = _event(1, action="purchase_cart", customer=17, product=3)
+    queued = _published([
+        {},
+        {"actions": "purchase_cart"},
+        {"actions": "purchase_cart", "customers": "17"},
+        {"actions": "purchase_cart", "customers": "18"},
+        {"customers": "16,17", "products": "3"},
+        {"products": "4"},
+    ], event)
+    assert [len(frames) for frames in queued] == [1, 1, 1, 0, 1, 0]
+
+
+def test_products_match_by_id_or_title():
+    event = dict(_event(1, product=3), title="Yoga Mat")
+    queued = _published([{"products": "3"}, {"products": "Yoga Mat"}, {"products": "Desk Lamp"}], event)
+    assert [len(frames) for frames in queued] == [1, 1, 0]
+
+
+def test_batch_is_subset_per_subscriber():
+    batch = [_event(1, customer=1), _event(2, customer=2), _event(3, customer=1), _event(4, customer=3)]
+    queued = _published([{}, {"customers": "1"}, {"customers": "1,2,3"}, {"customers": "9"}], batch)
+    assert queued[0] == [batch]
+    assert queued[1] == [[batch[0], batch[2]]]
+    assert queued[2] == [batch]
+    assert queued[3] == []
+
+
+def test_subscribers_with_the_same_subset_share_a_frame():
+    async def run():
+        broadcaster = Broadcaster()
+        first = broadcaster.add(FakeWebSocket(), wire.JSON, Subscription(customers={"1"}))
+        second = broadcaster.add(FakeWebSocket(), wire.JSON, Subscription(customers={"1"}, actions={"add_to_cart"}))
+        broadcaster.publish([_event(1, customer=1), _event(2, customer=2)])
+        shared = first.queue[0] is second.queue[0]
+        for subscriber in (first, second):
+            await broadcaster.remove(subscriber.websocket)
+        return shared
+    assert asyncio.run(run())
+
+
+def test_remove_drops_subscriber_from_index():
+    async def run():
+        broadcaster = Broadcaster()
+        subscriber = broadcaster.add(FakeWebSocket(), wire.JSON, Subscription(customers={"1"}))
+        await broadcaster.remove(subscriber.websocket)
+        return broadcaster._index, broadcaster._match(_event(1, customer=1))
+    index, matched = asyncio.run(run())
+    assert index == {"actions": {}, "customers": {}, "products": {}}
+    assert matched == []
+
+
+def _buffer(size, count):
+    buffer = ReplayBuffer(size)
+    buffer.extend([_event(n) for n in range(count)])
+    return buffer
+
+
+def _ids(events):
+    return [int(event["event_id"][1:]) for event in events]
+
+
+def test_replay_offsets_follow_the_ring():
+    buffer = _buffer(5, 8)
+    assert (buffer.first_offset, buffer.next_offset) == (3, 8)
+    assert _ids(buffer.read()) == [3, 4, 5, 6, 7]
+    assert _ids(buffer.read(from_offset=6)) == [6, 7]
+    assert _ids(buffer.read(from_offset=0)) == [3, 4, 5, 6, 7]
+    assert _ids(buffer.read(from_offset=8)) == []
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({"last": 2}, [6, 7]),
+    ({"last": 0}, []),
+    ({"last": 50}, [3, 4, 5, 6, 7]),
+    ({"from_offset": 4, "last": 2}, [6, 7]),
+    ({"from_offset": 6, "last": 4}, [6, 7]),
+])
+def test_replay_limits_combine(kwargs, expected):
+    assert _ids(_buffer(5, 8).read(**kwargs)) == expected
+
+
+def test_replay_since_filters_by_arrival_time(monkeypatch):
+    buffer = ReplayBuffer(10)
+    monkeypatch.setattr("broadcast.time.time", lambda: 1000.0)
+    buffer.extend([_event(0), _event(1)])
+    monkeypatch.setattr("broadcast.time.time", lambda: 1050.0)
+    buffer.extend([_event(2)])
+    assert _ids(buffer.read(since=30)) == [2]
+    assert _ids(buffer.read(since=60)) == [0, 1, 2]
@@ -0,0 +1,62 @@
+"""Cart rules of the vectorized backfill generator, checked by replaying its events."""
+from datetime import datetime
+
+import numpy as np
+
+from bulk_generator import BulkEventGenerator
+from event_simulator import CartManager
+
+CUSTOMERS = [str(cid) for cid in range(1, 31)]
+PRODUCTS = [{"id": pid, "title": f"Product {pid}", "price": float(pid), "image": None} for pid in (11, 12, 13, 14)]
+
+
+def _generate(seed=1, days=3, per_day=400):
+    generator = BulkEventGenerator(CUSTOMERS, PRODUCTS, seed=seed)
+    events = []
+    for _, batch in generator.generate_days(datetime(2024, 1, 1), datetime(2024, 1, 1 + days), per_day):
+        events.extend(batch.to_events())
+    return generator, events
+
+
+def test_events_follow_the_cart_rules():
+    generator, events = _generate()
+    carts = CartManager(CUSTOMERS)
+    for event in events:
+        cid, action = event["customer_id"], event["action"]
+        if action == "add_to_cart":
+            carts.add_to_cart(cid, event["product_id"])
+        elif action == "remove_from_cart":
+            assert event["product_id"] in carts.get_cart_products(cid)
+            carts.remove_from_cart(cid, event["product_id"])
+        else:
+            assert "product_id" not in event
+            assert carts.purchase_cart(cid), "purchase of an empty cart"
+    assert {event["action"] for event in events} == {"add_to_cart", "remove_from_cart", "purchase_cart"}
+
+    exported = CartManager(CUSTOMERS)
+    generator.export_carts(exported)
+    assert exported.carts == carts.carts
+
+
+def test_batches_are_in_timestamp_order():
+    _, events = _generate(days=1)
+    timestamps = [event["timestamp"] for event in events]
+    assert timestamps == sorted(timestamps)
+    assert timestamps[0] >= "2024-01-01T00:00:00Z" and timestamps[-1] < "2024-01-02T00:00:00Z"
+
+
+def test_seed_makes_output_reproducible():
+    _, first = _generate(seed=5, days=1)
+    _, second = _generate(seed=5, days=1)
+    _, other = _generate(seed=6, days=1)
+    assert first == second
+    assert first != other
+    assert len({event["event_id"] for event in first}) == len(first)
+
+
+def test_rows_match_events():
+    generator = BulkEventGenerator(CUSTOMERS, PRODUCTS, seed=2)
+    batch = generator.generate(200, np.datetime64("2024-03-01"), 3600)
+    for row, event in zip(batch.rows(), batch.to_events()):
+        assert row == (event["event_id"], event["customer_id"], event.get("product_id"),
+                       event.get("product_price"), event["action"], event["timestamp"])
@@ -0,0 +1,91 @@
+"""ArrayCartManager against the dict-based CartManager it replaces (no database needed)."""
+import random
+
+import numpy as np
+import pytest
+
+from cart_store import MAX_QUANTITY, ArrayCartManager, CustomerIds
+from event_simulator import CartManager
+
+
+@pytest.mark.parametrize("customers", [["1", "2", "3"], ["5", "40", "7", "1000"]])
+def test_random_operations_match_cart_manager(customers):
+    rng = random.Random(7)
+    expected = CartManager(customers)
+    carts = ArrayCartManager(customers, pool_size=2)
+    for _ in range(3000):
+        cid = rng.choice(customers)
+        op = rng.random()
+        if op < 0.5:
+            pid = rng.randint(1, 6)
+            expected.add_to_cart(cid, pid)
+            carts.add_to_cart(cid, pid)
+        elif op < 0.85:
+            pid = rng.randint(1, 6)
+            expected.remove_from_cart(cid, pid)
+            carts.remove_from_cart(cid, pid)
+        else:
+            assert carts.purchase_cart(cid) == expected.purchase_cart(cid)
+        assert carts.cart_empty(cid) == expected.cart_empty(cid)
+        assert carts.get_cart_products(cid) == expected.get_cart_products(cid)
+        assert carts.cart_items(cid) == expected.carts[cid]
+
+
+def test_items_keep_insertion_order():
+    carts = ArrayCartManager(["1"])
+    for pid in (5, 3, 9, 3):
+        carts.add_to_cart("1", pid)
+    carts.remove_from_cart("1", 5)
+    carts.add_to_cart("1", 5)
+    assert carts.cart_items("1") == {3: 2, 9: 1, 5: 1}
+    assert carts.get_cart_products("1") == [3, 9, 5]
+
+
+def test_freed_items_are_reused():
+    carts = ArrayCartManager(["1", "2"], pool_size=4)
+    for pid in range(4):
+        carts.add_to_cart("1", pid)
+    carts.purchase_cart("1")
+    for pid in range(4):
+        carts.add_to_cart("2", pid)
+    assert len(carts.item_product) == 4
+    carts.add_to_cart("2", 9)
+    assert len(carts.item_product) == 8
+    assert carts.cart_items("2") == {0: 1, 1: 1, 2: 1, 3: 1, 9: 1}
+
+
+def test_quantity_overflow_is_refused():
+    carts = ArrayCartManager(["1"])
+    carts.add_to_cart("1", 4, MAX_QUANTITY)
+    with pytest.raises(OverflowError):
+        carts.add_to_cart("1", 4)
+    with pytest.raises(OverflowError):
+        carts.set_cart("1", {5: MAX_QUANTITY + 1})
+    assert carts.cart_items("1") == {}
+
+
+def test_unknown_customer_raises_key_error():
+    for customers in (["1", "2"], ["1", "5"]):
+        with pytest.raises(KeyError):
+            ArrayCartManager(customers).add_to_cart("3", 1)
+
+
+def test_set_cart_and_last_updated():
+    carts = ArrayCartManager(["1"])
+    assert carts.last_updated("1") is None
+    carts.set_cart("1", {2: 3, 7: 1})
+    assert carts.cart_items("1") == {2: 3, 7: 1}
+    assert carts.last_updated("1") is not None
+    carts.set_cart("1", {})
+    assert carts.cart_empty("1") and carts.last_updated("1") is None
+
+
+def test_customer_ids_behave_like_the_str_list():
+    ids = CustomerIds(np.array([3, 4, 5, 6, 7]))
+    assert len(ids) == 5
+    assert ids[0] == "3" and list(ids) == ["3", "4", "5", "6", "7"]
+    assert list(ids[1::2]) == ["4", "6"]
+    assert random.Random(1).choice(ids) == random.Random(1).choice(list(ids))
+    assert np.asarray(ids).dtype == np.int64
+    assert np.asarray(ids, dtype=object).tolist() == list(ids)
+    assert ArrayCartManager(ids).ids.tolist() == [3, 4, 5, 6, 7]
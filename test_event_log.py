@@ -0,0 +1,74 @@
+"""Segment rotation, resume and reading of the receiver's JSON Lines event log."""
+import json
+import os
+
+from event_log import SegmentWriter, closed_segments, read_events
+
+
+def _writer(directory, max_segment_bytes=200):
+    return SegmentWriter(str(directory), max_segment_bytes=max_segment_bytes, fsync_interval=3600)
+
+
+def _events(start, count):
+    return [{"event_id": f"e{n}", "action": "add_to_cart"} for n in range(start, start + count)]
+
+
+def test_segments_rotate_at_the_size_limit(tmp_path):
+    writer = _writer(tmp_path)
+    writer.write_many(_events(0, 20))
+    writer.close()
+    segments = closed_segments(str(tmp_path))
+    assert len(segments) > 1
+    # A segment is closed by the first write that takes it to the limit
+    for path in segments[:-1]:
+        with open(path, "rb") as f:
+            lines = f.readlines()
+        assert sum(map(len, lines)) >= 200 > sum(map(len, lines[:-1]))
+    assert [os.path.basename(path) for path in segments][:2] == ["events-000001.jsonl", "events-000002.jsonl"]
+    assert list(read_events(str(tmp_path))) == _events(0, 20)
+
+
+def test_resume_appends_to_the_open_segment(tmp_path):
+    writer = _writer(tmp_path, max_segment_bytes=10_000)
+    writer.write_many(_events(0, 3))
+    writer.sync()
+    writer._file.close()  # crash: the segment stays .jsonl.open
+    with open(tmp_path / "events-000001.jsonl.open", "ab") as f:
+        f.write(b'{"event_id": "torn')
+
+    writer = _writer(tmp_path, max_segment_bytes=10_000)
+    writer.write_many(_events(3, 2))
+    writer.close()
+    assert [os.path.basename(path) for path in closed_segments(str(tmp_path))] == ["events-000001.jsonl"]
+    assert list(read_events(str(tmp_path))) == _events(0, 5)
+
+
+def test_sequence_numbers_skip_compacted_segments(tmp_path):
+    writer = _writer(tmp_path)
+    writer.write_many(_events(0, 20))
+    writer.close()
+    last = closed_segments(str(tmp_path))[-1]
+    os.makedirs(tmp_path / "compacted")
+    for path in closed_segments(str(tmp_path)):
+        os.replace(path, tmp_path / "compacted" / os.path.basename(path))
+
+    writer = _writer(tmp_path)
+    writer.write(_events(20, 1)[0])
+    writer.close()
+    [resumed] = closed_segments(str(tmp_path))
+    assert os.path.basename(resumed) > os.path.basename(last)
+
+
+def test_empty_segment_is_removed_on_close(tmp_path):
+    _writer(tmp_path).close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_read_events_accepts_legacy_files(tmp_path):
+    events = _events(0, 3)
+    array = tmp_path / "events.json"
+    array.write_text(json.dumps(events, indent=2))
+    lines = tmp_path / "lines.json"
+    lines.write_text("".join(json.dumps(event) + "\n" for event in events))
+    assert list(read_events(str(array))) == events
+    assert list(read_events(str(lines))) == events
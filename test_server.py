@@ -0,0 +1,89 @@
+"""Handshake tests for the WebSocket server (no database needed)."""
+import asyncio
+import json
+
+import pytest
+import websockets
+
+import server
+import wire
+from broadcast import Broadcaster
+
+
+@pytest.fixture(autouse=True)
+def fresh_server_state(monkeypatch):
+    monkeypatch.setattr(server, "broadcaster", Broadcaster())
+    monkeypatch.setattr(server, "clients", {})
+
+
+async def _wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def _subscribe(subprotocols, **params):
+    """Connect a subscriber, publish one event and return (subprotocol, frame received)"""
+    async with server.serve("127.0.0.1", 0) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        url = wire.with_params(f"ws://127.0.0.1:{port}", role=wire.SUBSCRIBER, **params)
+        async with websockets.connect(url, subprotocols=subprotocols) as ws:
+            await _wait_for(lambda: server.broadcaster.subscribers)
+            server.broadcast_event({"event_id": "e1", "action": "view_product"})
+            frame = await asyncio.wait_for(ws.recv(), 2)
+        await _wait_for(lambda: not server.clients and not server.broadcaster.subscribers)
+        return ws.subprotocol, frame
+
+
+def test_client_without_subprotocols_gets_json():
+    subprotocol, frame = asyncio.run(_subscribe(None))
+    assert subprotocol is None
+    assert json.loads(frame) == {"event_id": "e1", "action": "view_product"}
+
+
+def test_client_offer_is_negotiated():
+    subprotocol, frame = asyncio.run(_subscribe([wire.JSON.subprotocol]))
+    assert subprotocol == wire.JSON.subprotocol
+    assert json.loads(frame)["event_id"] == "e1"
+
+
+def test_first_supported_offer_wins():
+    offer = ["events.unknown", *wire.client_subprotocols()]
+    assert wire.select_subprotocol(offer, wire.server_subprotocols()) == wire.CODECS[0].subprotocol
+    assert wire.select_subprotocol(["events.unknown"], wire.server_subprotocols()) is None
+
+
+async def _connect_with(**params):
+    """Connect a subscriber with handshake params; returns (close code, frames received)"""
+    async with server.serve("127.0.0.1", 0) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        url = wire.with_params(f"ws://127.0.0.1:{port}", role=wire.SUBSCRIBER, **params)
+        frames = []
+        async with websockets.connect(url) as ws:
+            try:
+                while True:
+                    frames.append(json.loads(await asyncio.wait_for(ws.recv(), 2)))
+                    if isinstance(frames[-1], dict) and frames[-1].get("type") == "replay_complete":
+                        break
+            except websockets.exceptions.ConnectionClosed:
+                pass
+        await _wait_for(lambda: not server.clients and not server.broadcaster.subscribers)
+        return ws.close_code, frames
+
+
+@pytest.mark.parametrize("params", [{"last": "abc"}, {"since": "x"}, {"from_offset": "1.5"},
+                                    {"last": "-3"}, {"since": "nan"}])
+def test_bad_replay_params_are_refused_without_leaking(params):
+    code, frames = asyncio.run(_connect_with(**params))
+    assert code == 1008
+    assert frames == []
+    assert not server.clients and not server.broadcaster.subscribers
+
+
+def test_replay_last_events_before_live_frames():
+    server.broadcaster.publish([{"event_id": f"e{i}", "action": "view_product"} for i in range(5)])
+    code, frames = asyncio.run(_connect_with(last="2"))
+    assert [event["event_id"] for event in frames[0]] == ["e3", "e4"]
+    assert frames[1] == {"type": "replay_complete", "replayed": 2, "first_offset": 0,
+                         "next_offset": 5, "truncated": False}